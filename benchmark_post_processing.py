@@ -0,0 +1,166 @@
+import argparse
+import copy
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from functools import partial
+import networkx as nx
+from shapely.geometry import Polygon
+from post_processing_yolo import (find_overlap_components, post_process_masks,
+                                  merge_overlapping_masks, filter_by_confidence)
+from post_processing_pipeline import PostProcessingPipeline
+from synthetic_vgg import generate_vgg_predictions, parse_class_mix
+
+# Seuils de confiance de prediction_seuil.py (les labels du générateur étant des noms de
+# classes, filter_by_confidence ne fait que recopier les régions, comme en production)
+CLASS_THRESHOLDS = {0: 0.50, 1: 0.40, 2: 0.50, 3: 0.50, 4: 0.50, 5: 0.50,
+                    6: 0.47, 7: 0.50, 8: 0.25, 9: 0.50, 10: 0.30}
+
+STAGES = {
+    'post_process_masks': post_process_masks,
+    'post_process_masks[batch=image]': partial(post_process_masks, batch='image'),
+    'post_process_masks[batch=file]': partial(post_process_masks, batch='file'),
+    'merge_overlapping_masks': merge_overlapping_masks,
+    'filter_by_confidence': partial(filter_by_confidence, class_thresholds=CLASS_THRESHOLDS),
+    'pipeline': PostProcessingPipeline([
+        ('post_process_masks', {}),
+        ('merge_overlapping_masks', {}),
+        ('filter_by_confidence', {'class_thresholds': CLASS_THRESHOLDS}),
+    ]).run,
+}
+
+# Nombre de régions pour la comparaison de la recherche des chevauchements
+REGION_COUNTS = [50, 100, 200, 400, 800, 1600]
+
+
+def measure(func, data, repeat=1):
+    """Exécute func sur une copie des données et renvoie (meilleur temps en s, pic mémoire en Mo)."""
+    best_time = float('inf')
+    for _ in range(repeat):
+        sample = copy.deepcopy(data)
+        start = time.perf_counter()
+        func(sample)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    sample = copy.deepcopy(data)
+    tracemalloc.start()
+    func(sample)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak / 2 ** 20
+
+
+def count_vertices(data):
+    return sum(len(region['shape_attributes'].get('all_points_x', []))
+               for image_data in data.values() for region in image_data['regions'].values())
+
+
+def run_suite(args):
+    data = generate_vgg_predictions(args.images, args.regions, args.vertices, args.overlap,
+                                    args.class_mix, seed=args.seed)
+    rows = []
+    for name, func in STAGES.items():
+        if args.stages and name not in args.stages:
+            continue
+        seconds, peak_mb = measure(func, data, args.repeat)
+        rows.append({'stage': name, 'seconds': seconds, 'peak_mb': peak_mb})
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'params': {'images': args.images, 'regions': args.regions, 'vertices': args.vertices,
+                   'overlap': args.overlap, 'class_mix': args.class_mix, 'seed': args.seed},
+        'input': {'regions': args.images * args.regions, 'vertices': count_vertices(data)},
+        'results': rows,
+    }
+
+
+def print_table(report, baseline=None):
+    previous = {row['stage']: row for row in baseline['results']} if baseline else {}
+    header = f"{'stage':<34} {'time (s)':>10} {'peak (MB)':>10}"
+    if previous:
+        header += f" {'Δ time':>9} {'Δ peak':>9}"
+    print(header)
+    for row in report['results']:
+        line = f"{row['stage']:<34} {row['seconds']:>10.4f} {row['peak_mb']:>10.1f}"
+        before = previous.get(row['stage'])
+        if before:
+            line += f" {_relative(row['seconds'], before['seconds']):>9} {_relative(row['peak_mb'], before['peak_mb']):>9}"
+        print(line)
+
+
+def _relative(value, reference):
+    return f"{(value - reference) / reference:+.1%}" if reference else "n/a"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pairwise_components(polygons):
+    """Ancienne méthode : test de chaque paire puis parcours du graphe (référence)."""
+    G = nx.Graph()
+    for idx1, poly1 in enumerate(polygons):
+        G.add_node(idx1)
+        for idx2 in range(idx1 + 1, len(polygons)):
+            if poly1.intersects(polygons[idx2]):
+                G.add_edge(idx1, idx2)
+    return [sorted(component) for component in nx.connected_components(G)]
+
+
+def run_scaling(args):
+    """Compare la recherche des chevauchements par paires et par STRtree selon le nombre de régions."""
+    print(f"{'regions':>8} {'pairwise (s)':>13} {'strtree (s)':>12} {'speedup':>8}")
+    for count in REGION_COUNTS:
+        data = generate_vgg_predictions(1, count, args.vertices, args.overlap,
+                                        {'green_space': 1.0}, seed=args.seed)
+        polygons = [Polygon(zip(region['shape_attributes']['all_points_x'], region['shape_attributes']['all_points_y']))
+                    for image_data in data.values() for region in image_data['regions'].values()]
+
+        start = time.perf_counter()
+        expected = pairwise_components(polygons)
+        t_pairwise = time.perf_counter() - start
+        start = time.perf_counter()
+        components = find_overlap_components(polygons)
+        t_strtree = time.perf_counter() - start
+        assert sorted(expected) == sorted(components), "Les composantes diffèrent de la référence"
+        print(f"{count:>8} {t_pairwise:>13.4f} {t_strtree:>12.4f} {t_pairwise / t_strtree:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark des étapes de post-traitement sur des prédictions synthétiques.")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--regions", type=int, default=200, help="Régions par image")
+    parser.add_argument("--vertices", type=int, default=60, help="Sommets par polygone")
+    parser.add_argument("--overlap", type=float, default=0.3, help="Densité de chevauchement (0-1)")
+    parser.add_argument("--class-mix", type=parse_class_mix, default=None,
+                        help='Répartition des classes, ex. "green_space=0.5,parking=0.5"')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Nombre de mesures de temps par étape (meilleure gardée)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help="Étapes à mesurer (toutes par défaut)")
+    parser.add_argument("--output", help="Enregistre les résultats en JSON pour comparaison ultérieure")
+    parser.add_argument("--compare", help="Résultats JSON d'un commit précédent à comparer")
+    parser.add_argument("--scaling", action="store_true",
+                        help="Compare la recherche des chevauchements par paires et par STRtree")
+    args = parser.parse_args()
+
+    if args.scaling:
+        run_scaling(args)
+    else:
+        report = run_suite(args)
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if baseline.get('params') != report['params']:
+                print("Attention : paramètres différents de ceux de la référence.")
+        print_table(report, baseline)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Résultats enregistrés dans : {args.output}")
@@ -0,0 +1,133 @@
+import cv2
+import numpy as np
+
+# Classes exportables en RLE plutôt qu'en polygones (voir vgg_annotations_to_coco et
+# convert_yolo_to_vgg) : de grandes surfaces dont les contours comptent des milliers de sommets
+RLE_CLASSES = ("green_space", "parking")
+
+
+def _runs(mask):
+    """Longueurs des plages alternées 0 / 1 d'un masque lu colonne par colonne (ordre COCO)."""
+    flat = np.asarray(mask, dtype=bool).ravel(order='F')
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], changes, [flat.size])))
+    # Les plages commencent toujours par des 0
+    return np.concatenate(([0], runs)) if flat[0] else runs
+
+
+def _runs_to_string(runs):
+    """
+    Compresse des longueurs de plages en chaîne COCO (même codage que pycocotools).
+
+    Après la troisième plage, chaque valeur est l'écart avec la plage de même parité
+    précédente ; les valeurs sont écrites par blocs signés de 5 bits, en une passe NumPy.
+    """
+    runs = np.asarray(runs, dtype=np.int64)
+    values = runs.copy()
+    values[3:] -= runs[1:-2]
+    if values.size == 0:
+        return ''
+    # Nombre de blocs de chaque valeur : n blocs codent les valeurs de [-16 * 32**(n-1), 16 * 32**(n-1)[
+    magnitudes = np.where(values < 0, ~values, values)
+    lengths = np.searchsorted(16 * 32 ** np.arange(12, dtype=np.int64), magnitudes, side='right') + 1
+    owner = np.repeat(np.arange(values.size), lengths)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(owner.size) - starts[owner]
+    chars = ((values[owner] >> (5 * position)) & 0x1f) + 48
+    # Bit 0x20 : un autre bloc suit
+    chars[position < lengths[owner] - 1] += 0x20
+    return chars.astype(np.uint8).tobytes().decode('ascii')
+
+
+def _string_to_runs(counts):
+    """Décode une chaîne COCO en longueurs de plages."""
+    chars = np.frombuffer(counts.encode('ascii'), dtype=np.uint8).astype(np.int64) - 48
+    if chars.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Une valeur se termine au premier bloc sans le bit 0x20
+    ends = np.flatnonzero((chars & 0x20) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(chars.size) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chars & 0x1f) << (5 * position), starts)
+    # Extension du signe quand le bit de signe du dernier bloc est posé
+    negative = (chars[ends] & 0x10) != 0
+    values[negative] -= np.int64(1) << (5 * (position[ends[negative]] + 1))
+    # Après la troisième plage, les valeurs sont des écarts avec la plage de même parité
+    values[1::2] = np.cumsum(values[1::2])
+    values[2::2] = np.cumsum(values[2::2])
+    return values
+
+
+def _band_rle(band, first, width):
+    """
+    RLE d'une bande de colonnes [first, first + largeur de la bande[ d'un masque de
+    largeur width : les colonnes vides avant et après la bande sont ajoutées aux
+    plages de 0, ce qui donne le même codage que pycocotools sur le masque entier.
+    """
+    height = band.shape[0]
+    columns, rows = np.flatnonzero(band.any(axis=0)), np.flatnonzero(band.any(axis=1))
+    if columns.size == 0:
+        return None
+    runs = _runs(band)
+    area = int(runs[1::2].sum())
+    # Colonnes vides à gauche puis à droite de la bande
+    runs[0] += first * height
+    after = (width - first - band.shape[1]) * height
+    if after:
+        if runs.size % 2:
+            runs[-1] += after
+        else:
+            runs = np.append(runs, after)
+    bbox = [float(first + columns[0]), float(rows[0]),
+            float(columns[-1] - columns[0] + 1), float(rows[-1] - rows[0] + 1)]
+    return bbox, area, {"size": [height, width], "counts": _runs_to_string(runs)}
+
+
+def polygon_rle(points_x, points_y, height, width):
+    """
+    RLE COCO compressé d'un polygone VGG rastérisé dans une image (hauteur, largeur).
+
+    Le polygone n'est rastérisé que sur la bande de colonnes qu'il couvre, sur toute
+    la hauteur de l'image.
+
+    Returns:
+        tuple: (bbox, surface, rle) comme polygon_annotations, où rle est
+        {"size": [hauteur, largeur], "counts": chaîne COCO} ; None pour un polygone
+        de moins de 3 points ou qui ne couvre aucun pixel de l'image.
+    """
+    if len(points_x) < 3:
+        return None
+    points = np.round(np.column_stack((points_x, points_y))).astype(np.int32)
+    first = max(int(points[:, 0].min()), 0)
+    last = min(int(points[:, 0].max()), width - 1)
+    if last < first:
+        return None
+    points[:, 0] -= first
+    band = np.zeros((height, last - first + 1), dtype=np.uint8)
+    cv2.fillPoly(band, [points], 1)
+    return _band_rle(band, first, width)
+
+
+def mask_rle(mask):
+    """
+    RLE COCO compressé d'un masque binaire (hauteur, largeur) dans le repère de l'image,
+    trous compris.
+
+    Returns:
+        tuple: (bbox, surface, rle) comme polygon_rle, ou None pour un masque vide.
+    """
+    columns = np.flatnonzero(mask.any(axis=0))
+    if columns.size == 0:
+        return None
+    return _band_rle(mask[:, columns[0]:columns[-1] + 1], int(columns[0]), mask.shape[1])
+
+
+def rle_mask(rle):
+    """Masque binaire (hauteur, largeur) d'un RLE COCO compressé."""
+    height, width = rle['size']
+    runs = _string_to_runs(rle['counts'])
+    values = np.zeros(runs.size, dtype=bool)
+    values[1::2] = True
+    return np.ascontiguousarray(np.repeat(values, runs).reshape((width, height)).T)
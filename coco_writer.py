@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+
+# JSON compact, sans espaces
+SEPARATORS = (',', ':')
+
+
+def coco_segmentation(segmentation):
+    """Champ "segmentation" COCO : liste de polygones, ou le RLE tel quel (dictionnaire)."""
+    return segmentation if isinstance(segmentation, dict) else [segmentation]
+
+
+class CocoWriter:
+    """
+    Écrit un fichier COCO compact au fil de l'eau, avec des identifiants entiers stables.
+
+    Les images sont écrites directement dans le fichier et les annotations dans un
+    fichier temporaire recopié à la fermeture : seule l'annotation en cours est en
+    mémoire, quelle que soit la taille du jeu de données. Les images et les annotations
+    sont numérotées à partir de 1 dans l'ordre d'ajout ; chaque catégorie a pour
+    identifiant son indice dans class_mapping + 1, et les labels inconnus reçoivent
+    les identifiants suivants dans l'ordre d'apparition. Les mêmes entrées donnent
+    donc toujours le même fichier, octet pour octet.
+
+    Le fichier est écrit sous un nom temporaire (path + ".tmp") et ne prend son nom
+    définitif qu'à la fermeture : une exception dans le bloc with (ou abort) supprime
+    le fichier temporaire, si bien qu'un COCO tronqué n'est jamais publié.
+
+    Args:
+        path (str): Fichier COCO à écrire.
+        class_mapping (dict): Indice de classe -> label, le class_mapping des scripts
+            de prédiction.
+    """
+
+    def __init__(self, path, class_mapping):
+        self.path = path
+        self.category_ids = {label: index + 1 for index, label in sorted(class_mapping.items())}
+        self.image_count = 0
+        self.annotation_count = 0
+        self._temp_path = path + '.tmp'
+        self._file = open(self._temp_path, 'w')
+        self._file.write('{"images":[')
+        self._annotations = tempfile.TemporaryFile('w+', dir=os.path.dirname(path) or None)
+
+    def category_id(self, label):
+        """Identifiant de la catégorie d'un label, attribué à la suite s'il est inconnu."""
+        if label not in self.category_ids:
+            self.category_ids[label] = max(self.category_ids.values(), default=0) + 1
+        return self.category_ids[label]
+
+    def add_image(self, file_name, width, height):
+        """Écrit une image et renvoie son identifiant."""
+        self.image_count += 1
+        if self.image_count > 1:
+            self._file.write(',')
+        self._file.write(json.dumps({"id": self.image_count, "width": width, "height": height,
+                                     "file_name": file_name}, separators=SEPARATORS))
+        return self.image_count
+
+    def add_annotation(self, image_id, label, segmentation, area, bbox):
+        """Écrit une annotation (polygone ou RLE, voir coco_segmentation) et renvoie son identifiant."""
+        self.annotation_count += 1
+        if self.annotation_count > 1:
+            self._annotations.write(',')
+        # json.dumps (et non json.dump) pour profiter de l'encodeur C
+        self._annotations.write(json.dumps({
+            "id": self.annotation_count,
+            "segmentation": coco_segmentation(segmentation),
+            "area": area,
+            "iscrowd": 0,
+            "image_id": image_id,
+            "category_id": self.category_id(label),
+            "bbox": bbox
+        }, separators=SEPARATORS))
+        return self.annotation_count
+
+    def close(self):
+        """Recopie les annotations, écrit les catégories, ferme le fichier et le publie sous path."""
+        if self._file.closed:
+            return
+        try:
+            self._file.write('],"annotations":[')
+            self._annotations.seek(0)
+            shutil.copyfileobj(self._annotations, self._file)
+            self._annotations.close()
+            categories = [{"id": category_id, "name": label}
+                          for label, category_id in sorted(self.category_ids.items(), key=lambda item: item[1])]
+            self._file.write('],"categories":')
+            self._file.write(json.dumps(categories, separators=SEPARATORS))
+            self._file.write('}')
+            self._file.close()
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Abandonne l'écriture : les fichiers temporaires sont supprimés, path n'est pas modifié."""
+        if not os.path.exists(self._temp_path):
+            return
+        self._file.close()
+        self._annotations.close()
+        os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -1,43 +1,161 @@
 import os
 import json
-from shapely.geometry import Polygon
 import uuid
+import numpy as np
+from coco_rle import polygon_rle
+from coco_writer import CocoWriter, coco_segmentation
+from vgg_columnar import polygon_bounds, shoelace_areas
+from vgg_jsonl import iter_vgg_annotations
 
-def convert_vgg_to_coco(vgg_json_path, coco_json_path, default_width=1024, default_height=1024):
+
+def polygon_annotations(regions):
     """
-    Convertit un fichier d'annotations VGG en format COCO.
+    Boîte englobante, surface et segmentation COCO des polygones d'une image.
+
+    Les calculs sont faits en une fois pour toutes les régions de l'image, sur des
+    tableaux NumPy (voir vgg_columnar), sans shapely et sans modifier les listes de
+    points des régions. Comme avec shapely, chaque polygone est fermé en répétant son
+    premier point s'il ne l'est pas déjà ; la segmentation contient ce point.
+
+    Args:
+        regions (list): Régions VGG polygonales de l'image.
+
+    Returns:
+        list: (bbox, surface, segmentation) par région, ou None pour les polygones
+        de moins de 3 points.
+    """
+    xs = [region['shape_attributes']['all_points_x'] for region in regions]
+    ys = [region['shape_attributes']['all_points_y'] for region in regions]
+    offsets = np.zeros(len(regions) + 1, dtype=np.int64)
+    np.cumsum([len(points_x) for points_x in xs], out=offsets[1:])
+    all_x = np.fromiter((value for points_x in xs for value in points_x), dtype=np.float64, count=offsets[-1])
+    all_y = np.fromiter((value for points_y in ys for value in points_y), dtype=np.float64, count=offsets[-1])
+
+    bounds = polygon_bounds(all_x, all_y, offsets).tolist()
+    areas = shoelace_areas(all_x, all_y, offsets).tolist()
+
+    annotations = []
+    for points_x, points_y, (min_x, min_y, max_x, max_y), area in zip(xs, ys, bounds, areas):
+        if len(points_x) < 3:
+            annotations.append(None)
+            continue
+        # Coordonnées entrelacées x1, y1, x2, y2... (le type des valeurs est conservé)
+        segmentation = [value for point in zip(points_x, points_y) for value in point]
+        if points_x[0] != points_x[-1] or points_y[0] != points_y[-1]:
+            segmentation += segmentation[:2]
+        annotations.append(((min_x, min_y, max_x - min_x, max_y - min_y), area, segmentation))
+    return annotations
+
+
+def region_annotations(regions, height, width, rle_classes=None):
     """
-    def calculate_bbox(polygon_points):
-        """Calculate the bounding box of a polygon."""
-        if len(polygon_points['all_points_x']) < 3:
-            return None  # Invalid polygon
-        if (polygon_points['all_points_x'][0] != polygon_points['all_points_x'][-1] or
-            polygon_points['all_points_y'][0] != polygon_points['all_points_y'][-1]):
-            polygon_points['all_points_x'].append(polygon_points['all_points_x'][0])
-            polygon_points['all_points_y'].append(polygon_points['all_points_y'][0])
-        polygon = Polygon(zip(polygon_points['all_points_x'], polygon_points['all_points_y']))
-        min_x, min_y, max_x, max_y = polygon.bounds
-        return min_x, min_y, max_x - min_x, max_y - min_y
-
-    def calculate_area(polygon_points):
-        """Calculate the area of a polygon."""
-        if len(polygon_points['all_points_x']) < 3:
-            return 0  # Invalid polygon
-        if (polygon_points['all_points_x'][0] != polygon_points['all_points_x'][-1] or
-            polygon_points['all_points_y'][0] != polygon_points['all_points_y'][-1]):
-            polygon_points['all_points_x'].append(polygon_points['all_points_x'][0])
-            polygon_points['all_points_y'].append(polygon_points['all_points_y'][0])
-        polygon = Polygon(zip(polygon_points['all_points_x'], polygon_points['all_points_y']))
-        return polygon.area
+    Comme polygon_annotations, en exportant en RLE les régions des classes rle_classes.
+
+    Les polygones de ces classes sont rastérisés dans une image (hauteur, largeur) et
+    leur segmentation est le RLE COCO (voir coco_rle.polygon_rle) ; leur surface et leur
+    boîte englobante sont calculées sur le masque. Les masques vides donnent None.
+    """
+    is_rle = [bool(rle_classes) and region['region_attributes']['label'] in rle_classes
+              for region in regions]
+    if not any(is_rle):
+        return polygon_annotations(regions)
+    polygons = iter(polygon_annotations([region for region, rle in zip(regions, is_rle) if not rle]))
+    return [polygon_rle(region['shape_attributes']['all_points_x'], region['shape_attributes']['all_points_y'],
+                        height, width) if rle else next(polygons)
+            for region, rle in zip(regions, is_rle)]
+
+
+def entry_annotations(filename, image_info, default_width=1024, default_height=1024, rle_classes=None):
+    """
+    Taille de l'image et annotations COCO de toutes les régions d'une entrée VGG.
+
+    Les régions polygonales passent par region_annotations ; les régions « rle » de
+    l'entrée (clé "rle_regions", encodées depuis les masques YOLO, voir
+    convert_yolo_to_vgg) sont reprises telles quelles, avec leur surface et leur
+    boîte englobante.
+
+    Returns:
+        tuple: (largeur, hauteur, liste de couples (label, annotation)), où annotation
+        vaut None pour une région invalide.
+
+    Raises:
+        ValueError: Si des polygones doivent être exportés en RLE alors que l'entrée
+            n'a pas de "width" / "height" : rastérisés à la taille par défaut, leurs
+            masques seraient tronqués.
+    """
+    regions = list(image_info.get('regions', {}).values())
+    labels = [region['region_attributes']['label'] for region in regions]
+    size_known = "width" in image_info and "height" in image_info
+    if not size_known and rle_classes and any(label in rle_classes for label in labels):
+        raise ValueError(f"Taille de l'image inconnue pour {filename} (pas de width / height dans "
+                         "l'entrée VGG) : ses polygones ne peuvent pas être exportés en RLE")
+    width, height = image_info.get("width", default_width), image_info.get("height", default_height)
+
+    annotations = list(zip(labels, region_annotations(regions, height, width, rle_classes)))
+    for region in image_info.get('rle_regions', {}).values():
+        shape_attr = region['shape_attributes']
+        rle = {"size": shape_attr['size'], "counts": shape_attr['counts']}
+        annotations.append((region['region_attributes']['label'], (shape_attr['bbox'], shape_attr['area'], rle)))
+    return width, height, annotations
+
+
+def add_coco_entry(writer, filename, image_info, default_width=1024, default_height=1024, rle_classes=None):
+    """
+    Ajoute une entrée VGG (image, régions polygonales et régions RLE) à un CocoWriter.
+
+    Peut servir de rappel au fil de la prédiction (voir on_entry dans
+    inference.predict_to_annotations) pour écrire le COCO sans fichier VGG.
+    Les régions des classes rle_classes sont écrites en RLE (voir entry_annotations).
+
+    Returns:
+        int: Identifiant COCO de l'image.
+    """
+    width, height, annotations = entry_annotations(filename, image_info, default_width, default_height,
+                                                   rle_classes)
+    image_id = writer.add_image(filename, width, height)
+    for category_name, annotation in annotations:
+        writer.category_id(category_name)
+        if annotation is None:  # Ignorer les polygones invalides
+            continue
+        bbox, area, segmentation = annotation
+        writer.add_annotation(image_id, category_name, segmentation, area, bbox)
+    return image_id
+
+
+def vgg_annotations_to_coco(annotations, coco_json_path, default_width=1024, default_height=1024,
+                            compact=False, class_mapping=None, rle_classes=None):
+    """
+    Écrit des annotations VGG en mémoire au format COCO, sans passer par un fichier VGG.
+
+    Args:
+        annotations: Dictionnaire {clé: entrée VGG} (par exemple le résultat du
+            post-traitement) ou itérable de couples (clé, entrée).
+        coco_json_path (str): Fichier COCO à écrire.
+        compact (bool): Voir convert_vgg_to_coco.
+        class_mapping (dict): Catégories du mode compact (voir coco_writer), obligatoire
+            avec compact=True.
+        rle_classes (iterable): Labels dont les polygones sont exportés en RLE COCO,
+            rastérisés à la taille de l'image (voir region_annotations) ; par exemple
+            coco_rle.RLE_CLASSES. Les entrées doivent alors avoir leur "width" et leur
+            "height" (voir entry_annotations). Les régions VGG elles-mêmes restent
+            polygonales ; les régions "rle_regions" sont toujours exportées en RLE.
+    """
+    if isinstance(annotations, dict):
+        annotations = annotations.items()
 
     # Vérifier et créer le répertoire parent du fichier COCO
     coco_dir = os.path.dirname(coco_json_path)
-    if not os.path.exists(coco_dir):
+    if coco_dir and not os.path.exists(coco_dir):
         os.makedirs(coco_dir)
 
-    # Lecture du fichier VGG
-    with open(vgg_json_path) as file:
-        vgg_data = json.load(file)
+    if compact:
+        if class_mapping is None:
+            raise ValueError("Le mode compact a besoin de class_mapping pour numéroter les catégories")
+        with CocoWriter(coco_json_path, class_mapping) as writer:
+            for filename, image_info in annotations:
+                add_coco_entry(writer, filename, image_info, default_width, default_height, rle_classes)
+        print(f"Conversion terminée. Les données COCO sont enregistrées dans : {coco_json_path}")
+        return
 
     # Initialisation de la structure de base COCO
     coco_data = {
@@ -50,17 +168,18 @@ def convert_vgg_to_coco(vgg_json_path, coco_json_path, default_width=1024, defau
     category_ids = {}
 
     # Traitement de chaque image dans les données VGG
-    for filename, image_info in vgg_data.items():
+    for filename, image_info in annotations:
         image_id = str(uuid.uuid4())  # ID d'image unique
+        width, height, annotations = entry_annotations(filename, image_info, default_width, default_height,
+                                                       rle_classes)
         coco_data['images'].append({
             "id": image_id,
-            "width": image_info.get("width", default_width),
-            "height": image_info.get("height", default_height),
+            "width": width,
+            "height": height,
             "file_name": filename
         })
 
-        for region in image_info.get('regions', {}).values():
-            category_name = region['region_attributes']['label']
+        for category_name, annotation in annotations:
             if category_name not in category_ids:
                 category_id = str(uuid.uuid4())  # ID unique pour la catégorie
                 category_ids[category_name] = category_id
@@ -71,22 +190,13 @@ def convert_vgg_to_coco(vgg_json_path, coco_json_path, default_width=1024, defau
             else:
                 category_id = category_ids[category_name]
 
-            polygon_points = region['shape_attributes']
-            bbox = calculate_bbox(polygon_points)
-            if not bbox:  # Ignorer les polygones invalides
+            if annotation is None:  # Ignorer les polygones invalides
                 continue
-            area = calculate_area(polygon_points)
-
-            segmentation = []
-            all_x = polygon_points['all_points_x']
-            all_y = polygon_points['all_points_y']
-            for point in range(len(all_x)):
-                segmentation.append(all_x[point])
-                segmentation.append(all_y[point])
+            bbox, area, segmentation = annotation
 
             coco_data['annotations'].append({
                 "id": str(uuid.uuid4()),
-                "segmentation": [segmentation],
+                "segmentation": coco_segmentation(segmentation),
                 "area": area,
                 "iscrowd": 0,
                 "image_id": image_id,
@@ -99,3 +209,22 @@ def convert_vgg_to_coco(vgg_json_path, coco_json_path, default_width=1024, defau
         json.dump(coco_data, file, indent=4)
 
     print(f"Conversion terminée. Les données COCO sont enregistrées dans : {coco_json_path}")
+
+
+def convert_vgg_to_coco(vgg_json_path, coco_json_path, default_width=1024, default_height=1024,
+                        compact=False, class_mapping=None, rle_classes=None):
+    """
+    Convertit un fichier d'annotations VGG en format COCO.
+
+    Le fichier VGG peut être un JSON classique ou des annotations JSON-Lines
+    (voir vgg_jsonl), lues image par image.
+
+    Avec compact=True, le fichier COCO est écrit au fil de la lecture par un
+    CocoWriter (voir coco_writer) : JSON compact, identifiants entiers stables
+    (catégories tirées de class_mapping) et mémoire bornée. Sinon, le format
+    d'origine est conservé (identifiants uuid4, indentation de 4). Voir
+    vgg_annotations_to_coco pour rle_classes.
+    """
+    vgg_annotations_to_coco(iter_vgg_annotations(vgg_json_path), coco_json_path, default_width,
+                            default_height, compact=compact, class_mapping=class_mapping,
+                            rle_classes=rle_classes)
@@ -1,66 +1,162 @@
 import os
-import json
-import cv2
-import glob
-def yolo_results_to_vgg(results, class_mapping, output_file):
+import torch
+from ultralytics.utils import ops
+from raster_merge import raster_merge_regions
+from vgg_jsonl import open_vgg_writer
+from vgg_regions import polygon_region, rle_region
+
+def _file_size(path):
+    """Size of an image file, or None if it is missing (a single stat call)."""
+    try:
+        return os.stat(path).st_size
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def iter_yolo_results_to_vgg_entries(results, class_mapping, merge=None, rle_classes=None):
     """
-    Convert YOLOv8 segmentation results to VGG JSON format with confidence scores.
+    Convert a batch of YOLOv8 segmentation results to VGG entries, one result at a time.
+
+    The classes and confidences of the whole batch are moved to host memory in one
+    transfer (one device synchronization per batch instead of two per detection), each
+    contour array is turned into its point lists with a single tolist() call and the
+    file size is read with one stat call per image. Every entry carries the image
+    "width" and "height" (result.orig_shape), used by the COCO export.
 
     Args:
-        results (list): YOLOv8 results containing polygons, class information, and scores.
+        results (list): ultralytics `Results` objects, e.g. the results of one model batch.
         class_mapping (dict): Mapping of class indices to class labels.
-        output_file (str): Path to save the VGG JSON file.
+        merge (str): None for one polygon per detection, or "raster" (see yolo_results_to_vgg).
+        rle_classes (iterable): Labels whose masks are encoded as COCO RLE from the mask
+            tensor, holes included, instead of being vectorized (e.g. coco_rle.RLE_CLASSES).
+            They are stored under the entry's "rle_regions" (see vgg_regions.rle_region);
+            "regions" keeps the polygons of the other labels. Not supported with "raster".
+
+    Yields:
+        tuple: (image filename, VGG entry) per result, or None for the results without
+        a valid image path. The classes and confidences are transferred before the first
+        entry; the regions of each result are built when its entry is requested.
     """
-    vgg_data = {}
+    if rle_classes and merge == "raster":
+        raise ValueError("rle_classes is not supported with merge='raster'")
+    detected = [result.masks is not None and result.boxes is not None for result in results]
+    # Confidence and class columns of every detection of the batch, in one transfer
+    batch_boxes = [result.boxes.data[:, -2:] for result, has_detections in zip(results, detected) if has_detections]
+    host_boxes = []
+    if batch_boxes:
+        host_boxes = torch.cat(batch_boxes).cpu().tolist()
+
+    offset = 0
+    for result, has_detections in zip(results, detected):
+        count = len(result.boxes) if has_detections else 0
+        detections = host_boxes[offset:offset + count]
+        offset += count
 
-    for result in results:
-        if not hasattr(result, "path") or not os.path.exists(result.path):
-            print(f"Warning: Missing or invalid path for result {result}. Skipping.")
+        path = getattr(result, "path", None)
+        size = _file_size(path) if path else None
+        if size is None:
+            print(f"Warning: Missing or invalid path {path!r} for a result. Skipping.")
+            yield None
             continue
 
-        image_filename = os.path.basename(result.path)
+        image_filename = os.path.basename(path)
         vgg_entry = {
             "fileref": "",
-            "size": os.path.getsize(result.path),
+            "size": size,
             "filename": image_filename,
             "base64_img_data": "",
             "file_attributes": {},
-            "regions": {}
+            "regions": {},
+            "width": result.orig_shape[1],
+            "height": result.orig_shape[0]
         }
 
         # Check if masks and boxes are available
-        if result.masks is None or result.boxes is None:
+        if not has_detections:
             print(f"No masks or boxes detected for image: {image_filename}.")
-            vgg_data[image_filename] = vgg_entry
-            continue
+        elif merge == "raster":
+            vgg_entry["regions"] = raster_merge_regions(result, class_mapping)
+        else:
+            vgg_entry["regions"], rle_regions = _detection_regions(result, detections, class_mapping, rle_classes)
+            if rle_regions:
+                vgg_entry["rle_regions"] = rle_regions
+        yield image_filename, vgg_entry
 
-        # Iterate over each detection
-        region_index = 0
-        for segment, cls, conf in zip(result.masks.xy, result.boxes.cls, result.boxes.conf):
-            cls_index = int(cls)  # YOLO class indices start from 0
-            label = class_mapping.get(cls_index, f"class_{cls_index}")
-            confidence = float(conf)  # Convert confidence score to float
-
-            all_points_x = segment[:, 0].tolist()
-            all_points_y = segment[:, 1].tolist()
-
-            vgg_entry["regions"][str(region_index)] = {
-                "shape_attributes": {
-                    "name": "polygon",
-                    "all_points_x": all_points_x,
-                    "all_points_y": all_points_y
-                },
-                "region_attributes": {
-                    "label": label,
-                    "confidence": confidence
-                }
-            }
-            region_index += 1
-
-        vgg_data[image_filename] = vgg_entry
-
-    # Save to output file
-    with open(output_file, "w") as json_file:
-        json.dump(vgg_data, json_file, indent=4)
-    print(f"VGG annotations with confidence scores saved to {output_file}")
 
+def yolo_results_to_vgg_entries(results, class_mapping, merge=None, rle_classes=None):
+    """
+    Convert a batch of YOLOv8 segmentation results to VGG entries (see iter_yolo_results_to_vgg_entries).
+
+    Returns:
+        list: (image filename, VGG entry) per result, or None for the results without
+        a valid image path.
+    """
+    return list(iter_yolo_results_to_vgg_entries(results, class_mapping, merge=merge, rle_classes=rle_classes))
+
+
+def _detection_regions(result, detections, class_mapping, rle_classes=None):
+    """
+    One region per detection; detections holds the (confidence, class) pairs on the host.
+
+    The detections of rle_classes are encoded from their mask, brought back to image
+    coordinates one at a time; only the other masks are vectorized with masks.xy.
+
+    Returns:
+        tuple: (polygon regions, RLE regions), keyed by detection index.
+    """
+    labels = [class_mapping.get(int(cls), f"class_{int(cls)}") for _, cls in detections]
+    rle_indices = [idx for idx, label in enumerate(labels) if rle_classes and label in rle_classes]
+    if not rle_indices:
+        polygon_indices, segments = range(len(detections)), result.masks.xy
+    else:
+        polygon_indices = [idx for idx, label in enumerate(labels) if label not in rle_classes]
+        segments = result.masks[polygon_indices].xy if polygon_indices else []
+
+    regions = {}
+    for idx, segment in zip(polygon_indices, segments):
+        regions[str(idx)] = polygon_region(segment, labels[idx], detections[idx][0])
+    rle_regions = {}
+    for idx in rle_indices:
+        mask = ops.scale_masks(result.masks.data[idx][None, None].float(), result.orig_shape)[0, 0] > 0.5
+        region = rle_region(mask.cpu().numpy(), labels[idx], detections[idx][0])
+        if region is not None:
+            rle_regions[str(idx)] = region
+    return regions, rle_regions
+
+
+def yolo_result_to_vgg_entry(result, class_mapping, merge=None, rle_classes=None):
+    """
+    Convert a single YOLOv8 segmentation result to a VGG entry (see yolo_results_to_vgg_entries).
+
+    Returns:
+        tuple: (image filename, VGG entry), or None if the result has no valid image path.
+    """
+    return yolo_results_to_vgg_entries([result], class_mapping, merge=merge, rle_classes=rle_classes)[0]
+
+def yolo_results_to_vgg(results, class_mapping, output_file, merge=None, rle_classes=None):
+    """
+    Convert YOLOv8 segmentation results to VGG JSON format with confidence scores.
+
+    Each result is written to the file as soon as it is converted, so only the
+    current image is held in memory on top of the results themselves.
+
+    Args:
+        results (iterable): YOLOv8 results containing polygons, class information, and scores.
+            A generator (e.g. `model.predict(..., stream=True)`) is consumed one result at a time.
+        class_mapping (dict): Mapping of class indices to class labels.
+        output_file (str): Path to save the VGG JSON file. With a .jsonl path the
+            annotations are written one image per line (see vgg_jsonl).
+        merge (str): None to write one polygon per detection, or "raster" to merge
+            overlapping same-class masks at mask resolution (see raster_merge_regions).
+            With "raster", merge_overlapping_masks is no longer needed afterwards.
+        rle_classes (iterable): Labels encoded as RLE (see iter_yolo_results_to_vgg_entries).
+    """
+    if merge not in (None, "raster"):
+        raise ValueError(f"Unknown merge mode: {merge!r} (expected None or 'raster')")
+
+    with open_vgg_writer(output_file, indent=4) as writer:
+        for result in results:
+            converted = yolo_result_to_vgg_entry(result, class_mapping, merge=merge, rle_classes=rle_classes)
+            if converted is not None:
+                writer.write(*converted)
+    print(f"VGG annotations with confidence scores saved to {output_file}")
@@ -0,0 +1,45 @@
+import torch
+
+
+def filter_yolo_results(result, class_thresholds=None, default_threshold=0.0, min_area=0):
+    """
+    Drop low-confidence and small detections from a YOLO result before any polygon is built.
+
+    The per-class confidence thresholds and the minimum mask area are evaluated as
+    tensor operations on `result.boxes.conf`, `result.boxes.cls` and the mask pixel
+    counts, on the device the result lives on. Discarded detections are removed from
+    the result, so they are never polygonized or serialized.
+
+    Args:
+        result: A single ultralytics `Results` object.
+        class_thresholds (dict): Confidence threshold per class index.
+        default_threshold (float): Threshold for the classes missing from class_thresholds.
+        min_area (float): Minimum mask area, in original image pixels. The mask pixel
+            count is rescaled from mask resolution with the letterbox gain, so it is an
+            approximation of the polygon area used by post_process_masks.
+
+    Returns:
+        Results: The same result if every detection is kept, otherwise a filtered copy.
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return result
+    class_thresholds = class_thresholds or {}
+
+    conf = boxes.conf
+    cls = boxes.cls.long()
+    table_size = max(len(result.names), max(class_thresholds, default=-1) + 1)
+    thresholds = [class_thresholds.get(class_index, default_threshold) for class_index in range(table_size)]
+    thresholds = torch.tensor(thresholds, dtype=conf.dtype, device=conf.device)
+    keep = conf >= thresholds[cls]
+
+    if min_area > 0 and result.masks is not None:
+        masks = result.masks.data
+        mask_height, mask_width = masks.shape[1:]
+        orig_height, orig_width = result.orig_shape
+        gain = min(mask_height / orig_height, mask_width / orig_width)
+        keep &= masks.sum(dim=(1, 2)) >= min_area * gain ** 2
+
+    if bool(keep.all()):
+        return result
+    return result[keep]
@@ -0,0 +1,130 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+# Threads used to read the image headers (the check is I/O bound)
+VALIDATION_THREADS = 8
+
+# Default number of decoder threads of ImagePrefetcher
+DECODE_THREADS = 4
+
+
+def is_readable_image(img_path):
+    """
+    Check that a file is an image OpenCV can decode, without decoding it.
+
+    Only the file signature is read (cv2.haveImageReader), so the pixels are decoded
+    once per run, by the model. Empty files and files of an unknown format are rejected;
+    a truncated image passes the check and is handled when it is decoded for inference.
+    """
+    try:
+        return os.path.getsize(img_path) > 0 and cv2.haveImageReader(img_path)
+    except (OSError, cv2.error):
+        return False
+
+
+def validate_images(image_files, threads=VALIDATION_THREADS):
+    """
+    Keep the files that look like readable images, in input order.
+
+    Args:
+        image_files (list): Paths of the candidate files.
+        threads (int): Number of threads reading the headers.
+
+    Returns:
+        list: Paths of the valid images.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        readable = list(executor.map(is_readable_image, image_files))
+
+    valid_image_files = []
+    for img_path, ok in zip(image_files, readable):
+        if ok:
+            valid_image_files.append(img_path)
+        else:
+            print(f"Invalid or corrupted image file: {img_path}. Skipping.")
+    return valid_image_files
+
+
+def _decode(img_path):
+    start = time.perf_counter()
+    image = cv2.imread(img_path)
+    return image, time.perf_counter() - start
+
+
+class ImagePrefetcher:
+    """
+    Decode images in background threads while the model runs on the previous batch.
+
+    The images are read by a pool of decoder threads (cv2.imread releases the GIL) and
+    handed out in input order. At most `depth` images are decoded ahead of the consumer,
+    which bounds the memory held by the queue. Resizing and letterboxing stay in the
+    model's own preprocessing, which must see the original image to map the masks back.
+
+    Args:
+        image_files (list): Paths of the images to decode.
+        threads (int): Number of decoder threads.
+        depth (int): Maximum number of images decoded ahead of the consumer.
+    """
+
+    def __init__(self, image_files, threads=DECODE_THREADS, depth=8):
+        self.image_files = image_files
+        self.threads = threads
+        self.depth = max(1, depth)
+        self.decoded = 0
+        self.failed = 0
+        self.decode_s = 0.0
+        self.wait_s = 0.0
+
+    def __iter__(self):
+        """Yield (path, image) in input order; unreadable images are reported and skipped."""
+        paths = iter(self.image_files)
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            for img_path in paths:
+                pending.append((img_path, executor.submit(_decode, img_path)))
+                if len(pending) >= self.depth:
+                    break
+            while pending:
+                img_path, future = pending.popleft()
+                start = time.perf_counter()
+                image, decode_s = future.result()
+                self.wait_s += time.perf_counter() - start
+                self.decode_s += decode_s
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append((next_path, executor.submit(_decode, next_path)))
+                if image is None:
+                    self.failed += 1
+                    print(f"Error reading image {img_path}. Skipping.")
+                    continue
+                self.decoded += 1
+                yield img_path, image
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def batches(self, batch_size):
+        """Yield (paths, images) batches of at most batch_size decoded images."""
+        paths, images = [], []
+        for img_path, image in self:
+            paths.append(img_path)
+            images.append(image)
+            if len(images) == batch_size:
+                yield paths, images
+                paths, images = [], []
+        if images:
+            yield paths, images
+
+    def stats(self):
+        """Decoder statistics for the run report; wait_s is the time the consumer was blocked."""
+        return {
+            "threads": self.threads,
+            "depth": self.depth,
+            "decoded": self.decoded,
+            "failed": self.failed,
+            "decode_s": self.decode_s,
+            "wait_s": self.wait_s,
+        }
@@ -0,0 +1,165 @@
+import os
+import time
+from contextlib import nullcontext
+import torch
+from convert_yolo_to_vgg import iter_yolo_results_to_vgg_entries
+from image_io import ImagePrefetcher
+from run_stats import count_annotations
+from vgg_jsonl import open_vgg_writer
+
+# Rough device memory needed per image at imgsz=1024 for a segmentation model,
+# used to size GPU batches from the free memory
+GPU_MEMORY_PER_IMAGE_MB = 600
+MAX_BATCH_SIZE = 32
+
+
+def select_device():
+    """Use the first GPU when one is available, the CPU otherwise."""
+    return 0 if torch.cuda.is_available() else "cpu"
+
+
+def auto_batch_size(device, imgsz=1024):
+    """
+    Pick an inference batch size for the device.
+
+    On GPU the batch is sized from the free device memory; on CPU it grows with
+    the number of cores, since larger batches keep the intra-op threads busy.
+    """
+    if device != "cpu" and torch.cuda.is_available():
+        free_bytes, _ = torch.cuda.mem_get_info(device)
+        per_image_mb = GPU_MEMORY_PER_IMAGE_MB * (imgsz / 1024) ** 2
+        batch_size = int(0.7 * free_bytes / 2 ** 20 / per_image_mb)
+    else:
+        batch_size = (os.cpu_count() or 1) // 2
+    return max(1, min(MAX_BATCH_SIZE, batch_size))
+
+
+def iter_batches(items, batch_size):
+    """Split a list into consecutive batches of at most batch_size items."""
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def predict_to_annotations(model, image_files, class_mapping, output_file, batch_size, stats=None,
+                           result_filter=None, merge=None, decode_threads=0, prefetch_depth=None,
+                           on_entry=None, rle_classes=None, **predict_kwargs):
+    """
+    Run the model and write the VGG annotations while the results are produced.
+
+    Batches are run with `model.predict(..., stream=True)`; the results of each batch are
+    converted together to VGG regions (see yolo_results_to_vgg_entries, with one host
+    transfer per batch), written to `output_file` and released before the next batch.
+    Peak memory is bounded by the batch size instead of the number of images, and the
+    output file is identical to predicting everything then calling yolo_results_to_vgg.
+
+    With decode_threads > 0, the images are decoded by an ImagePrefetcher while the
+    model runs on the previous batch, and the decoded arrays are passed to the model.
+    Annotated images are drawn from the entries by rendering.AsyncRenderer (pass its
+    submit method as on_entry) rather than with model.predict(save=True).
+
+    Args:
+        model: An ultralytics YOLO model.
+        image_files (list): Paths of the images to process.
+        class_mapping (dict): Mapping of class indices to class labels.
+        output_file (str): VGG file to write (.json, or .jsonl for JSON-Lines), or None to
+            only pass the entries to on_entry (e.g. to write COCO directly, see add_coco_entry).
+        batch_size (int): Number of images per call (see auto_batch_size).
+        stats (RunStats): Optional instrumentation; each batch is recorded as a "predict"
+            stage (inference and conversion), the conversion alone as "yolo_results_to_vgg",
+            with the number of regions and polygon vertices written. Every image also gets a
+            "predict" record with its share of the batch inference time and a
+            "yolo_results_to_vgg" record with its own conversion time and counts.
+        result_filter (callable): Optional function applied to each result before conversion
+            (e.g. filter_yolo_results).
+        merge (str): Merge mode passed to yolo_results_to_vgg_entries.
+        decode_threads (int): Number of decoder threads (0 lets the model read the files).
+        prefetch_depth (int): Maximum number of images decoded ahead of the model
+            (None = two batches). The prefetcher statistics are reported as "prefetch".
+        on_entry (callable): Optional callback called as on_entry(image path, filename, entry)
+            after each entry is written (e.g. RunManifest.record).
+        rle_classes (iterable): Labels whose masks are encoded as COCO RLE instead of
+            polygons (see convert_yolo_to_vgg.iter_yolo_results_to_vgg_entries).
+        **predict_kwargs: Extra arguments for model.predict (conf, device, ...).
+    """
+    prefetcher = None
+    if decode_threads:
+        prefetcher = ImagePrefetcher(image_files, threads=decode_threads,
+                                     depth=prefetch_depth or 2 * batch_size)
+        batches = ((images, paths) for paths, images in prefetcher.batches(batch_size))
+    else:
+        batches = ((batch, None) for batch in iter_batches(image_files, batch_size))
+
+    with open_vgg_writer(output_file, indent=4) if output_file else nullcontext() as writer:
+        for batch, paths in batches:
+            with stats.stage("predict", images=len(batch)) if stats is not None else nullcontext({}) as record:
+                wall_start, cpu_start = time.perf_counter(), time.process_time()
+                results = []
+                for result in _stream_batch(model, batch, predict_kwargs, paths):
+                    if result_filter is not None:
+                        result = result_filter(result)
+                    results.append(result)
+                # Inference time of the batch, shared equally by its images in the per-image records
+                inference_wall = (time.perf_counter() - wall_start) / max(1, len(results))
+                inference_cpu = (time.process_time() - cpu_start) / max(1, len(results))
+                with stats.stage("yolo_results_to_vgg", images=len(results)) if stats is not None else nullcontext({}) as convert_record:
+                    converted = []
+                    wall_start, cpu_start = time.perf_counter(), time.process_time()
+                    for entry in iter_yolo_results_to_vgg_entries(results, class_mapping, merge=merge,
+                                                                  rle_classes=rle_classes):
+                        converted.append(entry)
+                        if entry is not None and stats is not None:
+                            # The conversion of the first image includes the batch transfer
+                            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+                            image_counts = count_annotations(dict([entry]))
+                            stats.add_image(entry[0], "predict", inference_wall, inference_cpu,
+                                            batch_images=len(results))
+                            stats.add_image(entry[0], "yolo_results_to_vgg", wall, cpu,
+                                            regions=image_counts["regions"], vertices=image_counts["vertices"])
+                        wall_start, cpu_start = time.perf_counter(), time.process_time()
+                    counts = count_annotations(dict(entry for entry in converted if entry is not None))
+                    convert_record.update(regions=counts["regions"], vertices=counts["vertices"])
+                record.update(regions=counts["regions"], vertices=counts["vertices"])
+                for result, entry in zip(results, converted):
+                    if entry is not None:
+                        if writer is not None:
+                            writer.write(*entry)
+                        if on_entry is not None:
+                            on_entry(result.path, *entry)
+                del results
+    if prefetcher is not None and stats is not None:
+        stats.set("prefetch", prefetcher.stats())
+    if output_file:
+        print(f"VGG annotations with confidence scores saved to {output_file}")
+
+
+def _stream_batch(model, batch, predict_kwargs, paths=None):
+    """
+    Yield the results of one batch one at a time, retrying image by image if the batch fails.
+
+    `batch` holds image paths, or decoded images whose file paths are given by `paths`.
+    """
+    done = 0
+    try:
+        for result in model.predict(source=batch, batch=len(batch), stream=True, **predict_kwargs):
+            if paths is not None:
+                result.path = paths[done]
+            done += 1
+            yield result
+        return
+    except Exception as e:
+        name = batch[0] if paths is None else paths[0]
+        if len(batch) == 1:
+            print(f"Error during model prediction for {name}: {e}")
+            return
+        print(f"Error during batched prediction ({e}). Retrying the rest of the batch image by image.")
+
+    for index in range(done, len(batch)):
+        img_path = batch[index] if paths is None else paths[index]
+        try:
+            results = model.predict(source=batch[index], **predict_kwargs)
+        except Exception as e:
+            print(f"Error during model prediction for {img_path}: {e}")
+            continue
+        for result in results:
+            result.path = img_path
+            yield result
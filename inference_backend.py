@@ -0,0 +1,158 @@
+import argparse
+import glob
+import os
+import time
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+# "torch" runs the .pt checkpoint and "onnx" an ONNX Runtime export of it
+BACKENDS = ("torch", "onnx")
+
+
+def _is_stale(path, source):
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source)
+
+
+def export_onnx(weights, imgsz=1024):
+    """
+    Export a segmentation checkpoint to ONNX once, next to the weights.
+
+    The export has a dynamic batch dimension so that the batched prediction loops can
+    use it. An existing export newer than the weights is reused.
+
+    Returns:
+        str: Path of the ONNX model (best.onnx).
+    """
+    onnx_path = os.path.splitext(weights)[0] + ".onnx"
+    if _is_stale(onnx_path, weights):
+        onnx_path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True)
+    return onnx_path
+
+
+def prepare_backend(weights, backend="torch", imgsz=1024):
+    """Return the model file to load for an inference backend, exporting it if needed."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend!r} (expected one of {BACKENDS})")
+    if backend == "torch":
+        return weights
+    return export_onnx(weights, imgsz=imgsz)
+
+
+def load_model(weights, backend="torch", imgsz=1024):
+    """
+    Load the segmentation model for an inference backend.
+
+    The ONNX backend is run by ultralytics through ONNX Runtime and returns the same
+    `Results` objects as the PyTorch checkpoint, so the rest of the pipeline
+    (filter_yolo_results, yolo_results_to_vgg, ...) is unchanged.
+    """
+    return YOLO(prepare_backend(weights, backend, imgsz), task="segment")
+
+
+def _detections(result):
+    """Classes, confidences and flattened binary masks of a result, on the CPU."""
+    if result.masks is None or result.boxes is None or len(result.boxes) == 0:
+        return torch.zeros(0, dtype=torch.long), torch.zeros(0), torch.zeros(0, 0)
+    return (result.boxes.cls.long().cpu(), result.boxes.conf.cpu(),
+            (result.masks.data > 0.5).flatten(1).float().cpu())
+
+
+def _match(reference, candidate, iou_threshold):
+    """Greedy same-class matching of two detection sets by mask IoU."""
+    ref_cls, ref_conf, ref_masks = reference
+    cand_cls, cand_conf, cand_masks = candidate
+    if len(ref_cls) == 0 or len(cand_cls) == 0 or ref_masks.shape[1] != cand_masks.shape[1]:
+        return []
+    intersection = ref_masks @ cand_masks.T
+    union = ref_masks.sum(1)[:, None] + cand_masks.sum(1)[None, :] - intersection
+    iou = torch.where(ref_cls[:, None] == cand_cls[None, :], intersection / union.clamp(min=1), 0)
+
+    matches = []
+    used = set()
+    for i in torch.argsort(ref_conf, descending=True).tolist():
+        for j in torch.argsort(iou[i], descending=True).tolist():
+            if iou[i, j] < iou_threshold:
+                break
+            if j not in used:
+                used.add(j)
+                matches.append((float(iou[i, j]), abs(float(ref_conf[i] - cand_conf[j]))))
+                break
+    return matches
+
+
+def compare_backends(weights, image_files, backends=BACKENDS, imgsz=1024, conf=0.25, device="cpu",
+                     iou_threshold=0.5):
+    """
+    Compare the latency and the detections of several backends on the same images.
+
+    The first backend is the reference. For every other backend, detections are matched
+    to the reference ones of the same class by mask IoU: recall and precision are the
+    shares of reference and backend detections that found a match, and the matched pairs
+    give the mean mask IoU and the largest confidence difference.
+
+    Returns:
+        list: One dictionary per backend with latencies in milliseconds and the agreement
+        with the reference.
+    """
+    rows = []
+    reference = None
+    for backend in backends:
+        model = load_model(weights, backend, imgsz)
+        model.predict(source=image_files[0], imgsz=imgsz, conf=conf, device=device, verbose=False)  # warm-up
+
+        latencies, detections = [], []
+        for img_path in image_files:
+            start = time.perf_counter()
+            result = model.predict(source=img_path, imgsz=imgsz, conf=conf, device=device, verbose=False)[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            detections.append(_detections(result))
+
+        row = {
+            "backend": backend,
+            "mean_ms": float(np.mean(latencies)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "detections": sum(len(cls) for cls, _, _ in detections),
+        }
+        if reference is None:
+            reference = detections
+        else:
+            matches = [match for ref, cand in zip(reference, detections)
+                       for match in _match(ref, cand, iou_threshold)]
+            reference_count = sum(len(cls) for cls, _, _ in reference)
+            row.update({
+                "recall": len(matches) / reference_count if reference_count else 1.0,
+                "precision": len(matches) / row["detections"] if row["detections"] else 1.0,
+                "mean_mask_iou": float(np.mean([iou for iou, _ in matches])) if matches else None,
+                "max_conf_diff": max((diff for _, diff in matches), default=None),
+            })
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the latency and accuracy of the inference backends.")
+    parser.add_argument("images", help="Glob of the images to predict, e.g. 'test/dijon/images/*.*'")
+    parser.add_argument("--weights", default="best-weight-prediction/best.pt")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS),
+                        help="Backends to compare, the first one being the reference")
+    parser.add_argument("--imgsz", type=int, default=1024)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of images")
+    args = parser.parse_args()
+
+    image_files = sorted(glob.glob(args.images))[:args.limit]
+    if not image_files:
+        parser.error(f"No image matches {args.images}")
+    rows = compare_backends(args.weights, image_files, args.backends, args.imgsz, args.conf, args.device)
+
+    print(f"{'backend':<10} {'mean (ms)':>10} {'p95 (ms)':>9} {'dets':>6} {'recall':>7} {'precision':>9} {'mask IoU':>9} {'max Δconf':>10}")
+    for row in rows:
+        line = f"{row['backend']:<10} {row['mean_ms']:>10.1f} {row['p95_ms']:>9.1f} {row['detections']:>6}"
+        if "recall" in row:
+            iou = f"{row['mean_mask_iou']:.3f}" if row['mean_mask_iou'] is not None else "n/a"
+            diff = f"{row['max_conf_diff']:.3f}" if row['max_conf_diff'] is not None else "n/a"
+            line += f" {row['recall']:>7.3f} {row['precision']:>9.3f} {iou:>9} {diff:>10}"
+        print(line)
@@ -0,0 +1,178 @@
+from collections import defaultdict
+from shapely.geometry import Polygon, MultiPolygon
+from shapely.ops import unary_union
+from post_processing_yolo import (TOLERANCE, AREA_THRESHOLD, EXCLUDED_CLASSES,
+                                  find_overlap_components, map_images)
+
+
+class _Region:
+    """Région VGG en cours de traitement : le dictionnaire d'origine et sa géométrie.
+
+    La géométrie n'est construite qu'au premier besoin puis conservée entre les
+    étapes ; les coordonnées ne sont réécrites dans le dictionnaire qu'à la
+    sérialisation, et seulement si la géométrie a changé.
+    """
+    __slots__ = ('data', '_geometry', 'dirty')
+
+    def __init__(self, data, geometry=None):
+        self.data = data
+        self._geometry = None
+        self.dirty = False
+        if geometry is not None:
+            self.geometry = geometry
+
+    @property
+    def label(self):
+        return self.data['region_attributes'].get('label')
+
+    @property
+    def is_polygon(self):
+        return self.data['shape_attributes']['name'] == 'polygon'
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            shape_attr = self.data['shape_attributes']
+            self._geometry = Polygon(list(zip(shape_attr['all_points_x'], shape_attr['all_points_y'])))
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, polygon):
+        # Le format VGG ne conserve que le contour extérieur : les trous sont
+        # abandonnés dès maintenant pour que les étapes suivantes voient la même
+        # géométrie qu'après un aller-retour par le JSON.
+        if polygon.interiors:
+            polygon = Polygon(polygon.exterior)
+        self._geometry = polygon
+        self.dirty = True
+
+    def to_vgg(self):
+        if self.dirty:
+            x, y = self._geometry.exterior.coords.xy
+            self.data['shape_attributes'] = {
+                'name': 'polygon',
+                'all_points_x': list(x),
+                'all_points_y': list(y)
+            }
+            self.dirty = False
+        return self.data
+
+
+def _post_process_stage(regions, tolerance=TOLERANCE, area_threshold=AREA_THRESHOLD):
+    """Lissage et suppression des petits masques (voir post_process_masks)."""
+    output = []
+    for region in regions:
+        if not region.is_polygon:
+            continue
+        polygon = region.geometry
+        if not polygon.is_valid:
+            polygon = polygon.buffer(0)
+        if polygon.area < area_threshold:
+            continue
+        polygon = polygon.simplify(tolerance, preserve_topology=True)
+        if not polygon.is_valid or polygon.is_empty:
+            continue
+        if isinstance(polygon, MultiPolygon):
+            polygon = max(polygon.geoms, key=lambda p: p.area)
+        if not polygon.is_valid or polygon.is_empty:
+            continue
+        region.geometry = polygon
+        output.append(region)
+    return output
+
+
+def _merge_stage(regions, excluded_classes=EXCLUDED_CLASSES):
+    """Fusion des masques superposés de même classe (voir merge_overlapping_masks)."""
+    label_to_regions = defaultdict(list)
+    for region in regions:
+        if region.label:
+            label_to_regions[region.label].append(region)
+
+    output = []
+    for label, regions_list in label_to_regions.items():
+        if label in excluded_classes:
+            output.extend(regions_list)
+            continue
+
+        polygons = []
+        for region in regions_list:
+            if region.is_polygon:
+                polygon = region.geometry
+                if not polygon.is_valid:
+                    polygon = polygon.buffer(0)
+                polygons.append(polygon)
+
+        for component in find_overlap_components(polygons):
+            merged_polygon = unary_union([polygons[idx] for idx in component])
+            polys = merged_polygon.geoms if isinstance(merged_polygon, MultiPolygon) else [merged_polygon]
+            for poly in polys:
+                if poly.is_empty:
+                    continue
+                output.append(_Region({'shape_attributes': {'name': 'polygon'},
+                                       'region_attributes': {'label': label}}, poly))
+    return output
+
+
+def _filter_stage(regions, class_thresholds, default_threshold=0.0):
+    """Ajout des annotations au-dessus du seuil de leur classe (voir filter_by_confidence)."""
+    output = list(regions)
+    for region in regions:
+        try:
+            class_index = int(region.label)
+        except ValueError:
+            continue
+        confidence = float(region.data['region_attributes'].get('confidence', 0))
+        if confidence >= class_thresholds.get(class_index, default_threshold):
+            output.append(region)
+    return output
+
+
+STAGES = {
+    'post_process_masks': _post_process_stage,
+    'merge_overlapping_masks': _merge_stage,
+    'filter_by_confidence': _filter_stage,
+}
+
+
+class PostProcessingPipeline:
+    """Chaîne de post-traitement qui lit chaque polygone une seule fois.
+
+    Les étapes sont données sous forme de liste de couples (nom, paramètres),
+    les noms étant ceux des fonctions équivalentes de post_processing_yolo :
+
+        pipeline = PostProcessingPipeline([
+            ('post_process_masks', {'tolerance': 5.0}),
+            ('merge_overlapping_masks', {}),
+            ('filter_by_confidence', {'class_thresholds': class_thresholds}),
+        ])
+        data = pipeline.run(data)
+
+    Les géométries shapely restent en mémoire d'une étape à l'autre et le
+    dictionnaire `regions` n'est reconstruit qu'une fois, à la fin. Le résultat
+    est identique à l'appel successif des fonctions correspondantes.
+    """
+
+    def __init__(self, stages=None):
+        if stages is None:
+            stages = [('post_process_masks', {}), ('merge_overlapping_masks', {})]
+        self.stages = []
+        for name, params in stages:
+            self.add_stage(name, **params)
+
+    def add_stage(self, name, **params):
+        """Ajoute une étape à la fin de la chaîne."""
+        if name not in STAGES:
+            raise ValueError(f"Étape inconnue : {name!r} (disponibles : {', '.join(STAGES)})")
+        self.stages.append((name, params))
+        return self
+
+    def process_regions(self, regions):
+        """Applique toutes les étapes aux régions d'une image et renvoie les nouvelles régions."""
+        records = [_Region(region_data) for region_data in regions.values()]
+        for name, params in self.stages:
+            records = STAGES[name](records, **params)
+        return {str(idx): record.to_vgg() for idx, record in enumerate(records)}
+
+    def run(self, data, workers=None, chunksize=1):
+        """Applique la chaîne à toutes les images (workers / chunksize : voir map_images)."""
+        return map_images(self.process_regions, data, workers=workers, chunksize=chunksize)
@@ -1,146 +1,115 @@
 import json
-import networkx as nx
+from itertools import chain
+import numpy as np
+import shapely
+from shapely import STRtree
 from shapely.geometry import Polygon, MultiPolygon
 from shapely.ops import unary_union
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from vgg_jsonl import VggJsonlWriter, is_jsonl_path, iter_vgg_annotations
 # Paramètres globaux
 TOLERANCE = 5.0  # Tolérance pour le lissage des contours
 AREA_THRESHOLD = 1000  # Seuil de surface pour supprimer les petits masques
 EXCLUDED_CLASSES = ["roof_tuiles", "roof_ardoise", "roof_beton", "roof_autres"]
 
 def load_vgg_annotations(filepath):
-    """Charge les annotations VGG depuis un fichier JSON."""
+    """Charge les annotations VGG depuis un fichier JSON ou JSON-Lines (voir vgg_jsonl)."""
+    if is_jsonl_path(filepath):
+        return dict(iter_vgg_annotations(filepath))
     with open(filepath, 'r') as f:
         data = json.load(f)
     return data
 
-def save_vgg_annotations(data, filepath):
-    """Enregistre les annotations VGG dans un fichier JSON."""
+def save_vgg_annotations(data, filepath, shard_size=None):
+    """Enregistre les annotations VGG dans un fichier JSON, ou JSON-Lines si le chemin se termine par .jsonl."""
+    if is_jsonl_path(filepath):
+        with VggJsonlWriter(filepath, shard_size=shard_size) as writer:
+            writer.write_all(data)
+        return
     with open(filepath, 'w') as f:
         json.dump(data, f)
 
-def merge_overlapping_masks(data):
-    """Fusionne les masques superposés de même classe dans les annotations VGG,
-    sauf pour les classes spécifiées dans EXCLUDED_CLASSES."""
-    for image_key, image_data in data.items():
-        regions = image_data.get('regions', {})
-        # Regrouper les régions par label (classe)
-        label_to_regions = defaultdict(list)
-        for region_id, region_data in regions.items():
-            label = region_data['region_attributes'].get('label')
-            if label:
-                label_to_regions[label].append((region_id, region_data))
+def map_images(func, data, workers=None, chunksize=1, **kwargs):
+    """Applique func(regions, **kwargs) aux régions de chaque image et remplace
+    les régions par le résultat.
 
-        new_regions = {}
-        region_count = 0
-        # Pour chaque label, traiter les régions correspondantes
-        for label, regions_list in label_to_regions.items():
-            # Vérifier si la classe est exclue
-            if label in EXCLUDED_CLASSES:
-                # Ajouter directement les régions sans modification
-                for region_id, region_data in regions_list:
-                    new_regions[str(region_count)] = region_data
-                    region_count += 1
-                continue  # Passer à l'itération suivante pour éviter la fusion
-
-            # Créer des polygones à partir des régions
-            polygons = []
-            confidences = []
-            region_attrs_list = []
-            for idx, (region_id, region_data) in enumerate(regions_list):
-                shape_attr = region_data['shape_attributes']
-                if shape_attr['name'] == 'polygon':
-                    x_points = shape_attr['all_points_x']
-                    y_points = shape_attr['all_points_y']
-                    points = list(zip(x_points, y_points))
-                    polygon = Polygon(points)
-                    if not polygon.is_valid:
-                        polygon = polygon.buffer(0)  # Corriger les polygones invalides
-                    polygons.append(polygon)
-                    # Récupérer la confiance, en la convertissant en float
-                    confidence = float(region_data['region_attributes'].get('confidence', 0))
-                    confidences.append(confidence)
-                    region_attrs_list.append(region_data['region_attributes'])
-
-            # Construire un graphe des chevauchements
-            G = nx.Graph()
-            for idx1, poly1 in enumerate(polygons):
-                G.add_node(idx1)
-                for idx2 in range(idx1 + 1, len(polygons)):
-                    poly2 = polygons[idx2]
-                    if poly1.intersects(poly2):
-                        G.add_edge(idx1, idx2)
-
-            # Trouver les composantes connexes (groupes de polygones qui se chevauchent)
-            components = list(nx.connected_components(G))
-
-            # Traiter chaque composante
-            for component in components:
-                component_polygons = [polygons[idx] for idx in component]
-                # Fusionner les polygones dans la composante
-                merged_polygon = unary_union(component_polygons)
-                # Trouver le masque avec la confiance la plus élevée
-                max_confidence = -1
-                max_idx = None
-                for idx in component:
-                    conf = confidences[idx]
-                    if conf > max_confidence:
-                        max_confidence = conf
-                        max_idx = idx
-                # Obtenir les attributs du masque avec la plus haute confiance
-                max_region_attributes = region_attrs_list[max_idx]
-
-                # Gérer les MultiPolygons
-                if isinstance(merged_polygon, MultiPolygon):
-                    polys = merged_polygon.geoms
-                else:
-                    polys = [merged_polygon]
-
-                for poly in polys:
-                    if poly.is_empty:
-                        continue
-                    x, y = poly.exterior.coords.xy
-                    all_points_x = list(x)
-                    all_points_y = list(y)
-                    shape_attributes = {
-                        'name': 'polygon',
-                        'all_points_x': all_points_x,
-                        'all_points_y': all_points_y
-                    }
-                    region_attributes = {
-                        'label': label
-                        # Copier d'autres attributs si nécessaire
-                    }
-                    new_region = {
-                        'shape_attributes': shape_attributes,
-                        'region_attributes': region_attributes
-                    }
-                    new_regions[str(region_count)] = new_region
-                    region_count += 1
-
-        # Mettre à jour les régions de l'image avec les nouvelles régions fusionnées
-        image_data['regions'] = new_regions
+    Les images étant indépendantes, elles peuvent être réparties sur un pool de
+    processus : workers est le nombre de processus (None ou 1 : exécution
+    séquentielle) et chunksize le nombre d'images envoyées à la fois à chaque
+    processus. Les résultats sont réintégrés dans l'ordre des images.
+    """
+    if kwargs:
+        func = partial(func, **kwargs)
+    images = list(data.values())
+    regions = (image_data.get('regions', {}) for image_data in images)
+    if workers is None or workers <= 1:
+        for image_data, new_regions in zip(images, map(func, regions)):
+            image_data['regions'] = new_regions
+        return data
 
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_data, new_regions in zip(images, executor.map(func, regions, chunksize=chunksize)):
+            image_data['regions'] = new_regions
     return data
 
+def find_overlap_components(polygons):
+    """Regroupe les polygones qui se chevauchent en composantes connexes.
 
+    Les paires candidates sont obtenues en une seule requête groupée sur un
+    STRtree (filtre par boîtes englobantes puis test exact `intersects`), et les
+    composantes sont calculées par union-find. Les composantes sont renvoyées
+    dans l'ordre de leur plus petit indice, chacune triée par indice croissant.
+    """
+    parent = list(range(len(polygons)))
 
-def post_process_masks(data, tolerance=TOLERANCE, area_threshold=AREA_THRESHOLD):
-    """Effectue le post-traitement des masques : lissage, remplissage des trous, suppression des petits masques."""
-    for image_key, image_data in data.items():
-        regions = image_data.get('regions', {})
-        new_regions = {}
-        region_count = 0
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
 
-        for region_id, region_data in regions.items():
-            label = region_data['region_attributes'].get('label')
-            # Ne pas traiter les classes exclues
-            """if label in EXCLUDED_CLASSES:
+    if len(polygons) > 1:
+        tree = STRtree(polygons)
+        left, right = tree.query(polygons, predicate='intersects')
+        for idx1, idx2 in zip(left.tolist(), right.tolist()):
+            if idx1 < idx2:
+                root1, root2 = find(idx1), find(idx2)
+                if root1 != root2:
+                    parent[max(root1, root2)] = min(root1, root2)
+
+    components = defaultdict(list)
+    for idx in range(len(polygons)):
+        components[find(idx)].append(idx)
+    return list(components.values())
+
+def _merge_image_regions(regions):
+    """Fusionne les régions superposées de même classe d'une seule image."""
+    # Regrouper les régions par label (classe)
+    label_to_regions = defaultdict(list)
+    for region_id, region_data in regions.items():
+        label = region_data['region_attributes'].get('label')
+        if label:
+            label_to_regions[label].append((region_id, region_data))
+
+    new_regions = {}
+    region_count = 0
+    # Pour chaque label, traiter les régions correspondantes
+    for label, regions_list in label_to_regions.items():
+        # Vérifier si la classe est exclue
+        if label in EXCLUDED_CLASSES:
+            # Ajouter directement les régions sans modification
+            for region_id, region_data in regions_list:
                 new_regions[str(region_count)] = region_data
                 region_count += 1
-                continue    
-            """
-            # Lissage et suppression des petits masques
+            continue  # Passer à l'itération suivante pour éviter la fusion
+
+        # Créer des polygones à partir des régions
+        polygons = []
+        confidences = []
+        region_attrs_list = []
+        for idx, (region_id, region_data) in enumerate(regions_list):
             shape_attr = region_data['shape_attributes']
             if shape_attr['name'] == 'polygon':
                 x_points = shape_attr['all_points_x']
@@ -148,40 +117,266 @@ def post_process_masks(data, tolerance=TOLERANCE, area_threshold=AREA_THRESHOLD)
                 points = list(zip(x_points, y_points))
                 polygon = Polygon(points)
                 if not polygon.is_valid:
-                    polygon = polygon.buffer(0)
-                if polygon.area < area_threshold:
-                    continue
-                polygon = polygon.simplify(tolerance, preserve_topology=True)
-                if not polygon.is_valid or polygon.is_empty:
-                    continue
+                    polygon = polygon.buffer(0)  # Corriger les polygones invalides
+                polygons.append(polygon)
+                # Récupérer la confiance, en la convertissant en float
+                confidence = float(region_data['region_attributes'].get('confidence', 0))
+                confidences.append(confidence)
+                region_attrs_list.append(region_data['region_attributes'])
 
-                # Gérer les MultiPolygons
-                if isinstance(polygon, MultiPolygon):
-                    # Fusionner les polygones dans un seul (union) ou sélectionner le plus grand
-                    polygons = list(polygon.geoms)  # Extraire les polygones individuels
-                    polygon = max(polygons, key=lambda p: p.area)  # Sélectionner le plus grand polygone
+        # Trouver les composantes connexes (groupes de polygones qui se chevauchent)
+        components = find_overlap_components(polygons)
 
-                if not polygon.is_valid or polygon.is_empty:
-                    continue
+        # Traiter chaque composante
+        for component in components:
+            component_polygons = [polygons[idx] for idx in component]
+            # Fusionner les polygones dans la composante
+            merged_polygon = unary_union(component_polygons)
+            # Trouver le masque avec la confiance la plus élevée
+            max_confidence = -1
+            max_idx = None
+            for idx in component:
+                conf = confidences[idx]
+                if conf > max_confidence:
+                    max_confidence = conf
+                    max_idx = idx
+            # Obtenir les attributs du masque avec la plus haute confiance
+            max_region_attributes = region_attrs_list[max_idx]
 
-                # Extraire les coordonnées du polygone
-                x, y = polygon.exterior.coords.xy
+            # Gérer les MultiPolygons
+            if isinstance(merged_polygon, MultiPolygon):
+                polys = merged_polygon.geoms
+            else:
+                polys = [merged_polygon]
+
+            for poly in polys:
+                if poly.is_empty:
+                    continue
+                x, y = poly.exterior.coords.xy
+                all_points_x = list(x)
+                all_points_y = list(y)
                 shape_attributes = {
                     'name': 'polygon',
-                    'all_points_x': list(x),
-                    'all_points_y': list(y)
+                    'all_points_x': all_points_x,
+                    'all_points_y': all_points_y
                 }
-                region_data['shape_attributes'] = shape_attributes
-                new_regions[str(region_count)] = region_data
+                region_attributes = {
+                    'label': label
+                    # Copier d'autres attributs si nécessaire
+                }
+                new_region = {
+                    'shape_attributes': shape_attributes,
+                    'region_attributes': region_attributes
+                }
+                new_regions[str(region_count)] = new_region
                 region_count += 1
 
-        # Mettre à jour les régions de l'image
-        image_data['regions'] = new_regions
+    # Renvoyer les nouvelles régions fusionnées de l'image
+    return new_regions
 
-    return data
 
+def merge_overlapping_masks(data, workers=None, chunksize=1):
+    """Fusionne les masques superposés de même classe dans les annotations VGG,
+    sauf pour les classes spécifiées dans EXCLUDED_CLASSES.
 
-def filter_by_confidence(data, class_thresholds, default_threshold=0.0):
+    workers / chunksize : voir map_images (exécution parallèle par image).
+    """
+    return map_images(_merge_image_regions, data, workers=workers, chunksize=chunksize)
+
+
+
+def simplify_polygons_batch(xs_list, ys_list, tolerance=TOLERANCE, area_threshold=AREA_THRESHOLD):
+    """Version vectorisée (shapely 2) du traitement d'un lot de polygones.
+
+    Applique en une seule passe sur des tableaux de géométries la correction des
+    polygones invalides, le filtre de surface, le lissage et la sélection du plus
+    grand polygone. Renvoie, pour chaque polygone d'entrée, le couple
+    (all_points_x, all_points_y) du contour extérieur, ou None s'il est supprimé.
+    """
+    count = len(xs_list)
+    output = [None] * count
+    counts = np.fromiter((len(x) for x in xs_list), dtype=np.int64, count=count)
+    # Les polygones vides ont une surface nulle : ils sont toujours supprimés
+    non_empty = np.flatnonzero(counts > 0)
+    if non_empty.size == 0:
+        return output
+
+    coords = np.empty((int(counts.sum()), 2))
+    coords[:, 0] = np.fromiter(chain.from_iterable(xs_list), dtype=float, count=len(coords))
+    coords[:, 1] = np.fromiter(chain.from_iterable(ys_list), dtype=float, count=len(coords))
+    ring_indices = np.repeat(np.arange(non_empty.size), counts[non_empty])
+    polygons = shapely.polygons(shapely.linearrings(coords, indices=ring_indices))
+
+    invalid = ~shapely.is_valid(polygons)
+    polygons[invalid] = shapely.buffer(polygons[invalid], 0)
+    keep = shapely.area(polygons) >= area_threshold
+    polygons, non_empty = polygons[keep], non_empty[keep]
+
+    polygons = shapely.simplify(polygons, tolerance, preserve_topology=True)
+    keep = shapely.is_valid(polygons) & ~shapely.is_empty(polygons)
+    polygons, non_empty = polygons[keep], non_empty[keep]
+    if non_empty.size == 0:
+        return output
+
+    # Pour les MultiPolygons, conserver la partie de plus grande surface (la première en cas d'égalité)
+    parts, part_owner = shapely.get_parts(polygons, return_index=True)
+    order = np.lexsort((np.arange(parts.size), -shapely.area(parts), part_owner))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = part_owner[order][1:] != part_owner[order][:-1]
+    largest = parts[order[first]]
+    owners = non_empty[part_owner[order[first]]]
+
+    keep = shapely.is_valid(largest) & ~shapely.is_empty(largest)
+    largest, owners = largest[keep], owners[keep]
+
+    # Extraire les coordonnées de tous les contours extérieurs en une fois
+    exterior_coords, coord_owner = shapely.get_coordinates(
+        shapely.get_exterior_ring(largest), return_index=True)
+    splits = np.cumsum(np.bincount(coord_owner, minlength=largest.size))[:-1]
+    for owner, ring in zip(owners.tolist(), np.split(exterior_coords, splits)):
+        output[owner] = (ring[:, 0].tolist(), ring[:, 1].tolist())
+    return output
+
+
+def _post_process_regions_batch(regions_per_image, tolerance, area_threshold):
+    """Post-traitement vectorisé d'un groupe d'images (listes de régions) en une passe."""
+    polygon_regions = [
+        [region_data for region_data in regions.values()
+         if region_data['shape_attributes']['name'] == 'polygon']
+        for regions in regions_per_image
+    ]
+    flat_regions = list(chain.from_iterable(polygon_regions))
+    processed = iter(simplify_polygons_batch(
+        [region_data['shape_attributes']['all_points_x'] for region_data in flat_regions],
+        [region_data['shape_attributes']['all_points_y'] for region_data in flat_regions],
+        tolerance, area_threshold))
+
+    output = []
+    for regions_list in polygon_regions:
+        new_regions = {}
+        for region_data in regions_list:
+            result = next(processed)
+            if result is None:
+                continue
+            region_data['shape_attributes'] = {
+                'name': 'polygon',
+                'all_points_x': result[0],
+                'all_points_y': result[1]
+            }
+            new_regions[str(len(new_regions))] = region_data
+        output.append(new_regions)
+    return output
+
+
+def _post_process_image_regions(regions, tolerance=TOLERANCE, area_threshold=AREA_THRESHOLD, batch=None):
+    """Post-traitement des régions d'une seule image (voir post_process_masks)."""
+    if batch is not None:
+        return _post_process_regions_batch([regions], tolerance, area_threshold)[0]
+
+    new_regions = {}
+    region_count = 0
+
+    for region_id, region_data in regions.items():
+        label = region_data['region_attributes'].get('label')
+        # Ne pas traiter les classes exclues
+        """if label in EXCLUDED_CLASSES:
+            new_regions[str(region_count)] = region_data
+            region_count += 1
+            continue    
+        """
+        # Lissage et suppression des petits masques
+        shape_attr = region_data['shape_attributes']
+        if shape_attr['name'] == 'polygon':
+            x_points = shape_attr['all_points_x']
+            y_points = shape_attr['all_points_y']
+            points = list(zip(x_points, y_points))
+            polygon = Polygon(points)
+            if not polygon.is_valid:
+                polygon = polygon.buffer(0)
+            if polygon.area < area_threshold:
+                continue
+            polygon = polygon.simplify(tolerance, preserve_topology=True)
+            if not polygon.is_valid or polygon.is_empty:
+                continue
+
+            # Gérer les MultiPolygons
+            if isinstance(polygon, MultiPolygon):
+                # Fusionner les polygones dans un seul (union) ou sélectionner le plus grand
+                polygons = list(polygon.geoms)  # Extraire les polygones individuels
+                polygon = max(polygons, key=lambda p: p.area)  # Sélectionner le plus grand polygone
+
+            if not polygon.is_valid or polygon.is_empty:
+                continue
+
+            # Extraire les coordonnées du polygone
+            x, y = polygon.exterior.coords.xy
+            shape_attributes = {
+                'name': 'polygon',
+                'all_points_x': list(x),
+                'all_points_y': list(y)
+            }
+            region_data['shape_attributes'] = shape_attributes
+            new_regions[str(region_count)] = region_data
+            region_count += 1
+
+    # Renvoyer les nouvelles régions de l'image
+    return new_regions
+
+
+def post_process_masks(data, tolerance=TOLERANCE, area_threshold=AREA_THRESHOLD, batch=None,
+                       workers=None, chunksize=1):
+    """Effectue le post-traitement des masques : lissage, remplissage des trous, suppression des petits masques.
+
+    batch : None pour le traitement polygone par polygone, "image" pour traiter
+    toutes les régions d'une image en une passe vectorisée, "file" pour traiter
+    toutes les régions du fichier en une seule passe. Le résultat est identique.
+    workers / chunksize : voir map_images. En exécution parallèle, le mode "file"
+    est traité image par image dans chaque processus.
+    """
+    if batch not in (None, "image", "file"):
+        raise ValueError(f"Mode batch inconnu : {batch!r} (attendu : None, 'image' ou 'file')")
+    if batch == "file" and (workers is None or workers <= 1):
+        images = list(data.values())
+        new_regions = _post_process_regions_batch(
+            [image_data.get('regions', {}) for image_data in images], tolerance, area_threshold)
+        for image_data, regions in zip(images, new_regions):
+            image_data['regions'] = regions
+        return data
+
+    return map_images(_post_process_image_regions, data, workers=workers, chunksize=chunksize,
+                      tolerance=tolerance, area_threshold=area_threshold, batch=batch)
+
+
+def _filter_image_regions(regions, class_thresholds, default_threshold=0.0):
+    """Filtre par seuil de confiance les régions d'une seule image (voir filter_by_confidence)."""
+    new_regions = regions.copy()  # Conserver les annotations existantes
+    region_count = len(new_regions)  # Commencer à partir du nombre existant d'annotations
+
+    for region_id, region_data in regions.items():
+        label = region_data['region_attributes'].get('label')
+        confidence = float(region_data['region_attributes'].get('confidence', 0))
+
+        # Obtenir l'index de la classe depuis le label (supposé être convertible en entier)
+        try:
+            class_index = int(label)  # Si le label est un index numérique
+        except ValueError:
+            # Si le label n'est pas un index valide, ignorer l'annotation
+            #print(f"Annotation ignorée pour label non valide : {label}")
+            continue
+
+        # Obtenir le seuil pour la classe ou utiliser le seuil par défaut
+        threshold = class_thresholds.get(class_index, default_threshold)
+
+        # Ajouter uniquement les annotations qui dépassent le seuil de confiance
+        if confidence >= threshold:
+            new_regions[str(region_count)] = region_data
+            region_count += 1
+
+    # Renvoyer les régions avec les nouvelles annotations filtrées
+    return new_regions
+
+
+def filter_by_confidence(data, class_thresholds, default_threshold=0.0, workers=None, chunksize=1):
     """
     Ajoute les annotations qui satisfont les seuils de confiance spécifiques à chaque classe.
 
@@ -189,37 +384,11 @@ def filter_by_confidence(data, class_thresholds, default_threshold=0.0):
         data (dict): Annotations VGG au format JSON.
         class_thresholds (dict): Dictionnaire des seuils de confiance par classe (index numérique).
         default_threshold (float): Seuil de confiance par défaut pour les classes non définies.
+        workers (int): Nombre de processus pour le traitement parallèle des images (voir map_images).
+        chunksize (int): Nombre d'images envoyées à la fois à chaque processus.
 
     Returns:
         dict: Annotations mises à jour avec les annotations supplémentaires filtrées.
     """
-    for image_key, image_data in data.items():
-        regions = image_data.get('regions', {})
-        new_regions = regions.copy()  # Conserver les annotations existantes
-        region_count = len(new_regions)  # Commencer à partir du nombre existant d'annotations
-
-        for region_id, region_data in regions.items():
-            label = region_data['region_attributes'].get('label')
-            confidence = float(region_data['region_attributes'].get('confidence', 0))
-
-            # Obtenir l'index de la classe depuis le label (supposé être convertible en entier)
-            try:
-                class_index = int(label)  # Si le label est un index numérique
-            except ValueError:
-                # Si le label n'est pas un index valide, ignorer l'annotation
-                #print(f"Annotation ignorée pour label non valide : {label}")
-                continue
-
-            # Obtenir le seuil pour la classe ou utiliser le seuil par défaut
-            threshold = class_thresholds.get(class_index, default_threshold)
-
-            # Ajouter uniquement les annotations qui dépassent le seuil de confiance
-            if confidence >= threshold:
-                new_regions[str(region_count)] = region_data
-                region_count += 1
-           
-
-        # Mettre à jour les régions avec les nouvelles annotations filtrées
-        image_data['regions'] = new_regions
-
-    return data
+    return map_images(_filter_image_regions, data, workers=workers, chunksize=chunksize,
+                      class_thresholds=class_thresholds, default_threshold=default_threshold)
@@ -1,36 +1,47 @@
 import os
-import json
 from ultralytics import YOLO
-import cv2
 import glob
 from post_processing_yolo import *
 from convert_vgg_to_coco import *
 from convert_yolo_to_vgg import *
+from coco_writer import CocoWriter
+from run_stats import RunStats
+from image_io import validate_images
+from tiled_inference import predict_tiled_to_annotations
+from run_manifest import RunManifest
+from sharded_inference import predict_sharded
+from inference_backend import prepare_backend
+from rendering import AsyncRenderer, RenderPolicy
+from inference import auto_batch_size, predict_to_annotations, select_device
 
 # Set PyTorch CUDA allocation configuration
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:128"
 
-# Load YOLOv8 model with segmentation
-model = YOLO("best-weight-prediction/best.pt")
+# Load YOLOv8 model with segmentation. INFERENCE_BACKEND selects how it runs: "torch"
+# (the checkpoint) or "onnx" (ONNX Runtime, exported once next to the weights; needs the
+# optional onnx and onnxruntime packages).
+# Compare the backends with: python inference_backend.py "test/dijon/images/*.*"
+WEIGHTS = "best-weight-prediction/best.pt"
+INFERENCE_BACKEND = "torch"
+model_file = prepare_backend(WEIGHTS, INFERENCE_BACKEND)
+model = YOLO(model_file, task="segment")
 
 # Output directory for annotations
 output_dir = "runs/output_test_images"
 os.makedirs(output_dir, exist_ok=True)
 
+# Run instrumentation: per-stage and per-image timings and memory, written as JSON.
+# Set PROFILE_STAGE to a stage name (e.g. "predict") to export its cProfile statistics.
+PROFILE_STAGE = None
+stats = RunStats(profile_stage=PROFILE_STAGE, profile_path=os.path.join(output_dir, "run_profile.prof"))
+
 # Prepare the list of valid image files
 image_files = glob.glob('test/dijon/images/*.*')
 
-# Filter out non-image files or corrupted images
-valid_image_files = []
-for img_path in image_files:
-    try:
-        img = cv2.imread(img_path)
-        if img is not None:
-            valid_image_files.append(img_path)
-        else:
-            print(f"Invalid or corrupted image file: {img_path}. Skipping.")
-    except Exception as e:
-        print(f"Error reading image {img_path}: {e}. Skipping.")
+# Filter out non-image files: only the headers are read here, each image is
+# decoded once, by the model
+with stats.stage("validate_images", images=len(image_files)):
+    valid_image_files = validate_images(image_files)
 
 if not valid_image_files:
     print("No valid images found in the directory.")
@@ -51,27 +62,161 @@ class_mapping = {
     10: 'green_space'
 }
 
-# Initialize an empty list to store all results
-all_results = []
-
-# Process images one at a time
-for img_path in valid_image_files:
-    try:
-        result = model.predict(
-            source=img_path,
-            show_conf=True,
+# Inference device (first GPU if available, CPU otherwise) and batch size (None = auto)
+DEVICE = select_device()
+BATCH_SIZE = None
+batch_size = BATCH_SIZE or auto_batch_size(DEVICE)
+stats.set("inference", {"device": str(DEVICE), "batch_size": batch_size})
+
+# Image decoding overlapped with inference: DECODE_THREADS threads decode up to
+# PREFETCH_DEPTH images ahead of the model (None = two batches, 0 threads = off)
+DECODE_THREADS = 4
+PREFETCH_DEPTH = None
+
+# Tiled inference for images larger than the model input (orthophotos): None predicts
+# each image whole, otherwise images are cut in TILE_SIZE tiles overlapping by TILE_OVERLAP
+# pixels, and batch_size is the number of tiles per model call. Tiles are read as file
+# windows with the optional rasterio package, required when TILE_SIZE is set
+TILE_SIZE = None
+TILE_OVERLAP = 128
+
+# Sharded inference for CPU nodes: INFERENCE_WORKERS processes (None or 1 = in-process) each load
+# the model once and use THREADS_PER_WORKER torch threads (None = cores / workers).
+# The workers are forked and always run on the CPU, so set BATCH_SIZE on a GPU node (the
+# automatic GPU batch size initializes CUDA, which cannot be used after fork). Not used in tiled mode.
+INFERENCE_WORKERS = None
+THREADS_PER_WORKER = None
+
+# RLE_CLASSES lists labels whose masks are written to COCO as RLE instead of polygons
+# (e.g. coco_rle.RLE_CLASSES for the large area classes). They are encoded from the mask
+# tensors, holes included, and kept under "rle_regions" in the VGG entries, whose
+# "regions" stay polygons; in tiled mode their polygons are rasterized at the COCO export.
+RLE_CLASSES = ()
+
+# Resumable, incremental runs: images already predicted with the same weights and
+# settings (same content hash) are taken from the manifest. None predicts every image.
+# MANIFEST_COMPACT rewrites the manifest at the end of the run with only the records of
+# the current weights and settings (the others would be predicted again if they came back)
+MANIFEST_COMPACT = True
+MANIFEST_FILE = os.path.join(output_dir, "dijon_run_manifest.jsonl")
+manifest = None
+images_to_predict = valid_image_files
+if MANIFEST_FILE:
+    manifest = RunManifest(MANIFEST_FILE, WEIGHTS, config={"backend": INFERENCE_BACKEND, "conf": 0.25, "tile_size": TILE_SIZE,
+                                                          "tile_overlap": TILE_OVERLAP, "rle_classes": RLE_CLASSES})
+    with stats.stage("manifest", images=len(valid_image_files)):
+        images_to_predict = manifest.pending(valid_image_files)
+    print(f"{len(valid_image_files) - len(images_to_predict)} images already predicted, "
+          f"{len(images_to_predict)} to predict")
+
+# Annotated images, drawn from the predicted polygons by background threads into
+# output_dir/renders: RENDER_MODE "off", "every" (every RENDER_EVERY-th image),
+# "random" (a RENDER_FRACTION share of the images) or "all". Tiled images larger than
+# RENDER_MAX_SIZE are rendered on an overview downscaled to that size
+RENDER_MODE = "every"
+RENDER_EVERY = 20
+RENDER_FRACTION = 0.05
+RENDER_MAX_SIZE = 4096
+renderer = AsyncRenderer(os.path.join(output_dir, "renders"),
+                         RenderPolicy(RENDER_MODE, every=RENDER_EVERY, fraction=RENDER_FRACTION),
+                         class_mapping=class_mapping, max_size=RENDER_MAX_SIZE)
+
+# COCO annotations written from the predictions, without reading a VGG file back.
+# COCO_COMPACT writes compact JSON with stable integer IDs (see coco_writer), streamed as
+# the images are predicted; otherwise the legacy format (uuid IDs, indent=4) is written
+# at the end of the run. Incremental runs write them from the manifest.
+# WRITE_VGG also writes the VGG JSON file (for post-trait-only.py or inspection).
+WRITE_VGG = True
+COCO_COMPACT = False
+coco_json_path = os.path.join(output_dir,'dijon_coco_annotations.json')
+coco_writer = CocoWriter(coco_json_path, class_mapping) if COCO_COMPACT and not manifest else None
+coco_entries = {}
+
+
+def on_entry(img_path, filename, entry):
+    """Record each new VGG entry in the manifest or for the COCO export and queue its rendering."""
+    if manifest:
+        manifest.record(img_path, filename, entry)
+    elif coco_writer:
+        add_coco_entry(coco_writer, filename, entry, rle_classes=RLE_CLASSES)
+    else:
+        coco_entries[filename] = entry
+    renderer.submit(img_path, filename, entry)
+
+
+# Run the model and write the annotations as the results are produced
+# (results are converted and released batch by batch instead of kept in memory)
+output_vgg_file = os.path.join(output_dir, "dijon_vgg_annotations.json") if WRITE_VGG else None
+try:
+    if TILE_SIZE:
+        predict_tiled_to_annotations(
+            model,
+            images_to_predict,
+            class_mapping,
+            output_vgg_file,
+            batch_size,
+            stats=stats,
+            on_entry=on_entry,
+            tile_size=TILE_SIZE,
+            overlap=TILE_OVERLAP,
             conf=0.25,
-            save=True,
-            device=0
+            device=DEVICE
         )
-        all_results.extend(result)
-    except Exception as e:
-        print(f"Error during model prediction for {img_path}: {e}")
-        continue
-
-# Generate VGG JSON file
-output_vgg_file = os.path.join(output_dir, "dijon_vgg_annotations.json")
-yolo_results_to_vgg(all_results, class_mapping, output_vgg_file)
+    elif INFERENCE_WORKERS and INFERENCE_WORKERS > 1:
+        predict_sharded(
+            model_file,
+            images_to_predict,
+            class_mapping,
+            output_vgg_file,
+            batch_size,
+            INFERENCE_WORKERS,
+            threads_per_worker=THREADS_PER_WORKER,
+            stats=stats,
+            on_entry=on_entry,
+            rle_classes=RLE_CLASSES,
+            conf=0.25,
+            device="cpu"
+        )
+    else:
+        predict_to_annotations(
+            model,
+            images_to_predict,
+            class_mapping,
+            output_vgg_file,
+            batch_size,
+            stats=stats,
+            on_entry=on_entry,
+            rle_classes=RLE_CLASSES,
+            decode_threads=DECODE_THREADS,
+            prefetch_depth=PREFETCH_DEPTH,
+            conf=0.25,
+            device=DEVICE
+        )
+    renderer.close()
+except BaseException:
+    # Remove the partial COCO file instead of leaving it next to the outputs
+    if coco_writer:
+        coco_writer.abort()
+    raise
+stats.set("rendering", renderer.stats())
+
+# Finish the COCO file; with the manifest, the new predictions are merged with the
+# cached ones, in input order
+with stats.stage("coco_export"):
+    if manifest:
+        if output_vgg_file:
+            manifest.export(valid_image_files, output_vgg_file)
+        vgg_annotations_to_coco(manifest.iter_entries(valid_image_files), coco_json_path,
+                                compact=COCO_COMPACT, class_mapping=class_mapping, rle_classes=RLE_CLASSES)
+        stats.set("manifest", manifest.stats())
+        if MANIFEST_COMPACT:
+            manifest.compact()
+        manifest.close()
+    elif coco_writer:
+        coco_writer.close()
+        print(f"COCO annotations saved to {coco_json_path}")
+    else:
+        vgg_annotations_to_coco(coco_entries, coco_json_path, compact=False, rle_classes=RLE_CLASSES)
 
 #post-traitement des prédictions 
 # Charger les annotations VGG générées
@@ -91,8 +236,6 @@ yolo_results_to_vgg(all_results, class_mapping, output_vgg_file)
 
 #print(f"Post-traitement terminé. Fichier enregistré dans : {post_processed_file}")
 
-#convert vgg to coco 
-
-coco_json_path = os.path.join(output_dir,'dijon_coco_annotations.json')
-convert_vgg_to_coco(output_vgg_file, coco_json_path)
+stats.summary()
+stats.write_report(os.path.join(output_dir, "dijon_run_stats.json"))
 
@@ -1,35 +1,50 @@
 import os
-import json
 from ultralytics import YOLO
-import cv2
 import glob
+from functools import partial
 from post_processing_yolo import *
+from post_processing_pipeline import PostProcessingPipeline
 from convert_vgg_to_coco import *
 from convert_yolo_to_vgg import *
+from filter_yolo_results import filter_yolo_results
+from run_stats import RunStats, count_annotations
+from image_io import validate_images
+from tiled_inference import predict_tiled_to_annotations
+from run_manifest import RunManifest
+from sharded_inference import predict_sharded
+from inference_backend import prepare_backend
+from rendering import AsyncRenderer, RenderPolicy
+from raw_result_cache import CachedModel, RawResultCache
+from inference import auto_batch_size, predict_to_annotations, select_device
 
 # Set PyTorch CUDA allocation configuration
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:128"
 
-# Load YOLOv8 model with segmentation
-model = YOLO("best-weight-prediction/best.pt")
+# Load YOLOv8 model with segmentation. INFERENCE_BACKEND selects how it runs: "torch"
+# (the checkpoint) or "onnx" (ONNX Runtime, exported once next to the weights; needs the
+# optional onnx and onnxruntime packages).
+# Compare the backends with: python inference_backend.py "test/beziers/*.*"
+WEIGHTS = "best-weight-prediction/best.pt"
+INFERENCE_BACKEND = "torch"
+model_file = prepare_backend(WEIGHTS, INFERENCE_BACKEND)
+model = YOLO(model_file, task="segment")
 
 # Output directory for annotations
 output_dir = "runs/output_test_images"
 os.makedirs(output_dir, exist_ok=True)
 
+# Run instrumentation: per-stage and per-image timings and memory, written as JSON.
+# Set PROFILE_STAGE to a stage name (e.g. "post_processing") to export its cProfile statistics.
+PROFILE_STAGE = None
+stats = RunStats(profile_stage=PROFILE_STAGE, profile_path=os.path.join(output_dir, "run_profile.prof"))
+
 # Prepare the list of valid image files
 image_files = glob.glob('test/beziers/*.*')
 
-valid_image_files = []
-for img_path in image_files:
-    try:
-        img = cv2.imread(img_path)
-        if img is not None:
-            valid_image_files.append(img_path)
-        else:
-            print(f"Invalid or corrupted image file: {img_path}. Skipping.")
-    except Exception as e:
-        print(f"Error reading image {img_path}: {e}. Skipping.")
+# Filter out non-image files: only the headers are read here, each image is
+# decoded once, by the model
+with stats.stage("validate_images", images=len(image_files)):
+    valid_image_files = validate_images(image_files)
 
 if not valid_image_files:
     print("No valid images found in the directory.")
@@ -63,48 +78,204 @@ class_thresholds = {
     10: 0.30
 }
 
-# Process images
-all_results = []
-for img_path in valid_image_files:
-    try:
-        result = model.predict(
-            source=img_path,
-            conf=0.25,  # Minimum general confidence threshold
-            save=True,
-            device=0
-        )
-        all_results.extend(result)
-    except Exception as e:
-        print(f"Error during model prediction for {img_path}: {e}")
-        continue
+# Per-class confidence and minimum mask area filters applied on the result tensors,
+# before any polygon is built (PREFILTER_MIN_AREA in original image pixels)
+PREFILTER_MIN_AREA = AREA_THRESHOLD
+
+# Same-class mask merging: "raster" merges the binary masks at mask resolution
+# while converting the results, None keeps the polygon merge of the post-processing
+MERGE_MODE = None
+
+# Post-processing executor: POST_PROCESSING_WORKERS > 1 spreads the images over a process
+# pool (e.g. os.cpu_count()); None or 1 keeps the serial execution. This script has no
+# `if __name__ == "__main__"` guard, so the pool is only safe with the fork start method
+# (Linux): with spawn (Windows, macOS) each worker would re-run the whole script.
+POST_PROCESSING_WORKERS = None
+POST_PROCESSING_CHUNKSIZE = 8
+
+# Inference device (first GPU if available, CPU otherwise) and batch size (None = auto)
+DEVICE = select_device()
+BATCH_SIZE = None
+batch_size = BATCH_SIZE or auto_batch_size(DEVICE)
+stats.set("inference", {"device": str(DEVICE), "batch_size": batch_size})
+
+# Image decoding overlapped with inference: DECODE_THREADS threads decode up to
+# PREFETCH_DEPTH images ahead of the model (None = two batches, 0 threads = off)
+DECODE_THREADS = 4
+PREFETCH_DEPTH = None
+
+# Tiled inference for images larger than the model input (orthophotos): None predicts
+# each image whole, otherwise images are cut in TILE_SIZE tiles overlapping by TILE_OVERLAP
+# pixels, and batch_size is the number of tiles per model call. Tiles are read as file
+# windows with the optional rasterio package, required when TILE_SIZE is set
+TILE_SIZE = None
+TILE_OVERLAP = 128
 
-# Generate VGG JSON file
-output_vgg_file = os.path.join(output_dir, "beziers_vgg_annotations.json")
-yolo_results_to_vgg(all_results, class_mapping, output_vgg_file)
+# Sharded inference for CPU nodes: INFERENCE_WORKERS processes (None or 1 = in-process) each load
+# the model once and use THREADS_PER_WORKER torch threads (None = cores / workers).
+# The workers are forked and always run on the CPU, so set BATCH_SIZE on a GPU node (the
+# automatic GPU batch size initializes CUDA, which cannot be used after fork). Not used in tiled mode.
+INFERENCE_WORKERS = None
+THREADS_PER_WORKER = None
 
+# Resumable, incremental runs: images already predicted with the same weights and
+# settings (same content hash) are taken from the manifest. None predicts every image.
+# MANIFEST_COMPACT rewrites the manifest at the end of the run with only the records of
+# the current weights and settings (the others would be predicted again if they came back)
+MANIFEST_COMPACT = True
+MANIFEST_FILE = os.path.join(output_dir, "beziers_run_manifest.jsonl")
+manifest = None
+images_to_predict = valid_image_files
+if MANIFEST_FILE:
+    manifest = RunManifest(MANIFEST_FILE, WEIGHTS, config={
+        "backend": INFERENCE_BACKEND, "conf": 0.25, "tile_size": TILE_SIZE, "tile_overlap": TILE_OVERLAP,
+        "class_thresholds": class_thresholds, "prefilter_min_area": PREFILTER_MIN_AREA, "merge": MERGE_MODE})
+    with stats.stage("manifest", images=len(valid_image_files)):
+        images_to_predict = manifest.pending(valid_image_files)
+    print(f"{len(valid_image_files) - len(images_to_predict)} images already predicted, "
+          f"{len(images_to_predict)} to predict")
 
-#post-traitement des prédictions 
-# Charger les annotations VGG générées
-data = load_vgg_annotations(output_vgg_file)
+# Raw inference cache, for threshold tuning sessions: with RAW_CACHE_DIR set (e.g.
+# os.path.join(output_dir, "raw_cache")), the model outputs of every image are stored there,
+# so class_thresholds, PREFILTER_MIN_AREA, TOLERANCE or AREA_THRESHOLD can be re-tuned without
+# running the model again. None disables it. Not used in tiled or sharded mode, and images
+# are then read by the model instead of the DECODE_THREADS prefetcher. The image hashes of
+# the run manifest are reused when there is one.
+RAW_CACHE_DIR = None
+predict_model = model
+if RAW_CACHE_DIR:
+    predict_model = CachedModel(model, RawResultCache(RAW_CACHE_DIR, WEIGHTS, config={
+        "backend": INFERENCE_BACKEND, "conf": 0.25}, content_hash=manifest.content_hash if manifest else None))
 
-# Effectuer le post-traitement des masques (lissage, suppression des petits masques, etc.)
-data = post_process_masks(data)
+# Annotated images, drawn from the predicted polygons by background threads into
+# output_dir/renders: RENDER_MODE "off", "every" (every RENDER_EVERY-th image),
+# "random" (a RENDER_FRACTION share of the images) or "all". Tiled images larger than
+# RENDER_MAX_SIZE are rendered on an overview downscaled to that size
+RENDER_MODE = "every"
+RENDER_EVERY = 20
+RENDER_FRACTION = 0.05
+RENDER_MAX_SIZE = 4096
+renderer = AsyncRenderer(os.path.join(output_dir, "renders"),
+                         RenderPolicy(RENDER_MODE, every=RENDER_EVERY, fraction=RENDER_FRACTION),
+                         class_mapping=class_mapping, max_size=RENDER_MAX_SIZE)
 
-# Fusionner les masques superposés de même classe
-data = merge_overlapping_masks(data)
+# The predicted entries are kept in memory for the post-processing, which writes the COCO
+# file directly (no VGG round-trip). WRITE_VGG also writes the raw and post-processed VGG
+# JSON files (for post-trait-only.py or inspection).
+WRITE_VGG = True
+data = {}
 
-# Filtrer les annotations par seuil de confiance
-data = filter_by_confidence(data, class_thresholds)
 
+def on_entry(img_path, filename, entry):
+    """Record each new VGG entry in the manifest (or keep it) and queue its rendering."""
+    if manifest:
+        manifest.record(img_path, filename, entry)
+    else:
+        data[filename] = entry
+    renderer.submit(img_path, filename, entry)
 
 
-# Enregistrer les annotations post-traitées dans un nouveau fichier JSON
-post_processed_file = os.path.join(output_dir, "beziers_vgg_annotations_post_traits_seuil_optimal.json")
-save_vgg_annotations(data, post_processed_file)
+# Run the model and convert the results as they are produced; each result is
+# filtered on its tensors, converted and released before the next batch
+output_vgg_file = os.path.join(output_dir, "beziers_vgg_annotations.json") if WRITE_VGG else None
+if TILE_SIZE:
+    predict_tiled_to_annotations(
+        model,
+        images_to_predict,
+        class_mapping,
+        output_vgg_file,
+        batch_size,
+        stats=stats,
+        on_entry=on_entry,
+        tile_size=TILE_SIZE,
+        overlap=TILE_OVERLAP,
+        # Confidence per tile, area once the tiles are reconciled (a cut object is small in each tile)
+        result_filter=partial(filter_yolo_results, class_thresholds=class_thresholds),
+        min_area=PREFILTER_MIN_AREA,
+        conf=0.25,  # Minimum general confidence threshold
+        device=DEVICE
+    )
+elif INFERENCE_WORKERS and INFERENCE_WORKERS > 1:
+    predict_sharded(
+        model_file,
+        images_to_predict,
+        class_mapping,
+        output_vgg_file,
+        batch_size,
+        INFERENCE_WORKERS,
+        threads_per_worker=THREADS_PER_WORKER,
+        stats=stats,
+        on_entry=on_entry,
+        result_filter=partial(filter_yolo_results, class_thresholds=class_thresholds, min_area=PREFILTER_MIN_AREA),
+        merge=MERGE_MODE,
+        conf=0.25,  # Minimum general confidence threshold
+        device="cpu"
+    )
+else:
+    predict_to_annotations(
+        predict_model,
+        images_to_predict,
+        class_mapping,
+        output_vgg_file,
+        batch_size,
+        stats=stats,
+        on_entry=on_entry,
+        decode_threads=0 if RAW_CACHE_DIR else DECODE_THREADS,
+        prefetch_depth=PREFETCH_DEPTH,
+        result_filter=partial(filter_yolo_results, class_thresholds=class_thresholds, min_area=PREFILTER_MIN_AREA),
+        merge=MERGE_MODE,
+        conf=0.25,  # Minimum general confidence threshold
+        device=DEVICE
+    )
 
-print(f"Post-traitement terminé. Fichier enregistré dans : {post_processed_file}")
+renderer.close()
+stats.set("rendering", renderer.stats())
+if RAW_CACHE_DIR:
+    stats.set("raw_cache", predict_model.stats())
 
-#convert vgg to coco 
+# Merge the new predictions with the cached ones, in input order
+if manifest:
+    if output_vgg_file:
+        manifest.export(valid_image_files, output_vgg_file)
+    data = dict(manifest.iter_entries(valid_image_files))
+    stats.set("manifest", manifest.stats())
+    if MANIFEST_COMPACT:
+        manifest.compact()
+    manifest.close()
 
+
+#post-traitement des prédictions (annotations VGG en mémoire)
+
+# Post-traitement en une seule passe par image : lissage et suppression des petits
+# masques, fusion des masques superposés de même classe (si elle n'a pas été faite
+# en raster, ce qui n'est pas le cas en mode tuilé), puis filtrage par seuil de confiance
+pipeline = PostProcessingPipeline([('post_process_masks', {})])
+if MERGE_MODE is None or TILE_SIZE:
+    pipeline.add_stage('merge_overlapping_masks')
+pipeline.add_stage('filter_by_confidence', class_thresholds=class_thresholds)
+with stats.stage("post_processing") as record:
+    data = pipeline.run(data, workers=POST_PROCESSING_WORKERS, chunksize=POST_PROCESSING_CHUNKSIZE)
+    record.update(count_annotations(data))
+
+# Enregistrer les annotations post-traitées dans un nouveau fichier JSON (optionnel)
+if WRITE_VGG:
+    post_processed_file = os.path.join(output_dir, "beziers_vgg_annotations_post_traits_seuil_optimal.json")
+    with stats.stage("save_vgg_annotations"):
+        save_vgg_annotations(data, post_processed_file)
+    print(f"Post-traitement terminé. Fichier enregistré dans : {post_processed_file}")
+
+# Export COCO direct des annotations post-traitées. COCO_COMPACT écrit un JSON compact aux
+# identifiants entiers stables (voir coco_writer) ; sinon, le format historique (identifiants
+# uuid, indent=4). Les polygones post-traités des classes RLE_CLASSES (par exemple
+# coco_rle.RLE_CLASSES, les grandes surfaces) sont rastérisés à la taille de l'image
+# (width / height des entrées) et exportés en masques RLE ; () n'exporte que des polygones
+COCO_COMPACT = False
+RLE_CLASSES = ()
 coco_json_path = os.path.join(output_dir,'beziers_coco_annotations_post_traits_seuil_optimal.json')
-convert_vgg_to_coco(post_processed_file, coco_json_path)
+with stats.stage("coco_export"):
+    vgg_annotations_to_coco(data, coco_json_path, compact=COCO_COMPACT, class_mapping=class_mapping,
+                            rle_classes=RLE_CLASSES)
+
+stats.summary()
+stats.write_report(os.path.join(output_dir, "beziers_run_stats.json"))
+
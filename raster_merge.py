@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+from ultralytics.utils import ops
+from post_processing_yolo import EXCLUDED_CLASSES
+from vgg_regions import polygon_region
+
+
+def raster_merge_regions(result, class_mapping, excluded_classes=EXCLUDED_CLASSES):
+    """
+    Merge overlapping same-class masks of one YOLO result in the raster domain.
+
+    For every class that is not excluded, the binary masks of `result.masks.data`
+    are OR-ed together at mask resolution, the connected components of the union
+    are labelled and each component is vectorized once. A merged region keeps the
+    highest confidence among the detections that overlap it. Detections of the
+    excluded classes are kept as individual polygons, as in yolo_results_to_vgg.
+    This replaces merge_overlapping_masks for the non-excluded classes with a cost
+    that depends on the mask size rather than on the number of overlaps.
+
+    Args:
+        result: A single ultralytics `Results` object with masks and boxes.
+        class_mapping (dict): Mapping of class indices to class labels.
+        excluded_classes (list): Labels that must not be merged.
+
+    Returns:
+        dict: VGG `regions` dictionary with contours in original image coordinates.
+    """
+    if result.masks is None or result.boxes is None or len(result.boxes) == 0:
+        return {}
+
+    regions = []
+    classes = result.boxes.cls.cpu().numpy().astype(int)
+    confidences = result.boxes.conf.cpu().numpy()
+    masks = result.masks.data
+    mask_shape = masks.shape[1:]
+
+    # Classes in order of first detection, so the output order is stable
+    for cls_index in dict.fromkeys(classes.tolist()):
+        label = class_mapping.get(cls_index, f"class_{cls_index}")
+        members = np.flatnonzero(classes == cls_index)
+
+        if label in excluded_classes:
+            for idx in members:
+                segment = result.masks.xy[idx]
+                if len(segment) >= 3:
+                    regions.append(polygon_region(segment, label, float(confidences[idx])))
+            continue
+
+        member_masks = masks[members.tolist()].bool().cpu().numpy()
+        union = member_masks.any(axis=0).astype(np.uint8)
+        component_count, component_map, component_stats, _ = cv2.connectedComponentsWithStats(union, connectivity=8)
+
+        # Highest confidence among the detections touching each component
+        component_conf = np.zeros(component_count)
+        for mask, confidence in zip(member_masks, confidences[members]):
+            touched = np.unique(component_map[mask])
+            component_conf[touched] = np.maximum(component_conf[touched], confidence)
+
+        # One external contour per 8-connected component (label 0 is the background),
+        # traced inside the component's bounding box so that a component lying in a
+        # hole of another one is not lost
+        for component in range(1, component_count):
+            x, y, width, height = component_stats[component, :4].tolist()
+            component_mask = (component_map[y:y + height, x:x + width] == component).astype(np.uint8)
+            contours, _ = cv2.findContours(component_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                           offset=(x, y))
+            contour = max(contours, key=len).reshape(-1, 2)
+            if len(contour) < 3:
+                continue
+            points = ops.scale_coords(mask_shape, contour.astype(np.float32), result.orig_shape, normalize=False)
+            regions.append(polygon_region(points, label, float(component_conf[component])))
+
+    return {str(idx): region for idx, region in enumerate(regions)}
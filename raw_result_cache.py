@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+from run_manifest import file_sha256
+
+
+class RawResultCache:
+    """
+    On-disk cache of the raw YOLO outputs of each image, to re-run the post-processing
+    and conversion chain without running the model again.
+
+    Each image is stored as one compressed .npz file holding the boxes (xyxy, confidence,
+    class), the masks as packed bits at mask resolution and the original image shape.
+    Files are keyed by the SHA-256 of the image content and grouped in a directory per
+    model key (hash of the weights and of the prediction settings), so a new model or new
+    settings never read stale outputs. Cached results are rebuilt as ultralytics `Results`
+    (masks.xy is recomputed from the masks, as for a fresh prediction), without the image
+    pixels: they cannot be plotted.
+
+    Args:
+        cache_dir (str): Root directory of the cache.
+        weights_path (str): Model weights; their hash is part of the model key.
+        config (dict): Prediction settings that change the raw outputs (conf, imgsz, backend, ...).
+        content_hash (callable): Optional function returning the SHA-256 of an image, e.g.
+            RunManifest.content_hash to reuse the hashes of the run manifest. By default the
+            images are hashed here, once per path, size and modification time.
+    """
+
+    def __init__(self, cache_dir, weights_path, config=None, content_hash=None):
+        settings = json.dumps(config or {}, sort_keys=True, default=str)
+        model_key = hashlib.sha256((file_sha256(weights_path) + settings).encode()).hexdigest()
+        self.directory = os.path.join(cache_dir, model_key[:16])
+        os.makedirs(self.directory, exist_ok=True)
+        self._content_hash = content_hash or self._file_hash
+        self._hashes = {}
+
+    def _file_hash(self, img_path):
+        stat = os.stat(img_path)
+        key = (os.path.abspath(img_path), stat.st_size, stat.st_mtime_ns)
+        sha256 = self._hashes.get(key)
+        if sha256 is None:
+            sha256 = self._hashes[key] = file_sha256(img_path)
+        return sha256
+
+    def _file(self, img_path):
+        sha256 = self._content_hash(img_path)
+        return os.path.join(self.directory, sha256[:2], sha256 + ".npz")
+
+    def save(self, result):
+        """Store the raw outputs of a result, under the content hash of result.path."""
+        arrays = {
+            "orig_shape": np.array(result.orig_shape),
+            "names": np.array(json.dumps(result.names)),
+            "boxes": result.boxes.data.cpu().numpy() if result.boxes is not None else np.zeros((0, 6), np.float32),
+        }
+        if result.masks is not None:
+            masks = result.masks.data.cpu().numpy()
+            arrays["masks"] = np.packbits(masks > 0, axis=-1)
+            arrays["mask_shape"] = np.array(masks.shape)
+            arrays["mask_dtype"] = np.array(str(masks.dtype))
+
+        path = self._file(result.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + ".tmp.npz"
+        np.savez_compressed(temporary, **arrays)
+        os.replace(temporary, path)
+
+    def load(self, img_path):
+        """Rebuild the `Results` of an image from the cache, or None if it is not cached."""
+        path = self._file(img_path)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            height, width = arrays["orig_shape"].tolist()
+            names = {int(key): value for key, value in json.loads(str(arrays["names"])).items()}
+            masks = None
+            if "masks" in arrays:
+                shape = tuple(arrays["mask_shape"].tolist())
+                unpacked = np.unpackbits(arrays["masks"], axis=-1, count=shape[-1])
+                masks = torch.from_numpy(unpacked.astype(str(arrays["mask_dtype"])))
+            boxes = torch.from_numpy(arrays["boxes"])
+        # Empty placeholder image: only its shape is used by Results
+        return Results(np.empty((height, width, 0), dtype=np.uint8), path=img_path, names=names,
+                       boxes=boxes, masks=masks)
+
+
+class CachedModel:
+    """
+    Stand-in for a YOLO model that answers predict() from a RawResultCache.
+
+    Images found in the cache are loaded from it; the others are predicted by the wrapped
+    model and stored. It can be passed to inference.predict_to_annotations in place of the
+    model, so the filtering, conversion and post-processing chain runs unchanged, in seconds
+    once every image is cached. Sources must be image paths: decoded arrays (prefetching,
+    tiles) have no key and are passed through to the model without caching.
+
+    Args:
+        model: The ultralytics YOLO model.
+        cache (RawResultCache): The cache to read and fill.
+    """
+
+    def __init__(self, model, cache):
+        self.model = model
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def predictor(self):
+        return self.model.predictor
+
+    def predict(self, source, stream=False, **predict_kwargs):
+        results = self._predict(source, predict_kwargs)
+        return results if stream else list(results)
+
+    def _predict(self, source, predict_kwargs):
+        sources = source if isinstance(source, (list, tuple)) else [source]
+        if not all(isinstance(item, (str, os.PathLike)) for item in sources):
+            yield from self.model.predict(source=source, stream=True, **predict_kwargs)
+            return
+
+        cached = {img_path: self.cache.load(img_path) for img_path in sources}
+        missing = [img_path for img_path, result in cached.items() if result is None]
+        self.hits += len(sources) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            if "batch" in predict_kwargs:
+                predict_kwargs = dict(predict_kwargs, batch=len(missing))
+            # The model returns absolute paths and skips unreadable images
+            predicted = {}
+            for result in self.model.predict(source=missing, stream=True, **predict_kwargs):
+                self.cache.save(result)
+                predicted[os.path.abspath(result.path)] = result
+            for img_path in missing:
+                cached[img_path] = predicted.get(os.path.abspath(img_path))
+
+        for img_path in sources:
+            if cached[img_path] is not None:
+                yield cached[img_path]
+
+    def stats(self):
+        """Cache hits and misses for the run report."""
+        return {"hits": self.hits, "misses": self.misses}
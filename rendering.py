@@ -0,0 +1,184 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from ultralytics.utils.plotting import colors
+from coco_rle import rle_mask
+from tiled_inference import open_tiled_image
+
+RENDER_MODES = ("off", "every", "random", "all")
+
+
+class RenderPolicy:
+    """
+    Which predicted images get an annotated copy written to disk.
+
+    Args:
+        mode (str): "off", "every" (every k-th image), "random" (a random fraction of
+            the images) or "all".
+        every (int): k for the "every" mode.
+        fraction (float): Share of the images rendered in the "random" mode.
+        seed (int): Seed of the "random" mode, for reproducible samples.
+    """
+
+    def __init__(self, mode="off", every=20, fraction=0.05, seed=0):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode: {mode!r} (expected one of {RENDER_MODES})")
+        self.mode = mode
+        self.every = max(1, every)
+        self.fraction = fraction
+        self._random = random.Random(seed)
+
+    def selected(self, index):
+        """Whether the index-th image (in prediction order) is rendered."""
+        if self.mode == "all":
+            return True
+        if self.mode == "every":
+            return index % self.every == 0
+        if self.mode == "random":
+            return self._random.random() < self.fraction
+        return False
+
+
+def draw_vgg_entry(image, entry, class_mapping=None, alpha=0.4, line_width=2, scale=1.0):
+    """
+    Draw the polygons and RLE masks ("rle_regions") of a VGG entry on an image (in place)
+    and return it.
+
+    Masks are filled with a translucent color per class and outlined, with the label
+    and confidence at the top-left of each region. Colors follow the ultralytics
+    palette when class_mapping (class index -> label) is given. scale maps the polygon
+    coordinates to the image, for an image downscaled from the original.
+    """
+    label_ids = {label: index for index, label in (class_mapping or {}).items()}
+    overlay = image.copy()
+    outlines = []
+    for region in entry.get("regions", {}).values():
+        shape_attr = region["shape_attributes"]
+        if shape_attr.get("name") != "polygon" or len(shape_attr.get("all_points_x", [])) < 3:
+            continue
+        points = np.column_stack([shape_attr["all_points_x"], shape_attr["all_points_y"]])
+        points = np.round(points * scale).astype(np.int32)
+        label = region["region_attributes"].get("label", "")
+        color = colors(label_ids.get(label, sum(map(ord, label))), bgr=True)
+        cv2.fillPoly(overlay, [points], color)
+        outlines.append((points, label, region["region_attributes"].get("confidence"), color))
+    for region in entry.get("rle_regions", {}).values():
+        mask = rle_mask(region["shape_attributes"]).astype(np.uint8)
+        if mask.shape != image.shape[:2]:
+            mask = cv2.resize(mask, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_NEAREST)
+        label = region["region_attributes"].get("label", "")
+        color = colors(label_ids.get(label, sum(map(ord, label))), bgr=True)
+        overlay[mask.astype(bool)] = color
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            outlines.append((contour.reshape(-1, 2), label, region["region_attributes"].get("confidence"), color))
+
+    cv2.addWeighted(overlay, alpha, image, 1 - alpha, 0, dst=image)
+    for points, label, confidence, color in outlines:
+        cv2.polylines(image, [points], True, color, line_width)
+        text = label if confidence is None else f"{label} {confidence:.2f}"
+        x, y = points.min(axis=0)
+        cv2.putText(image, text, (int(x), max(int(y) - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    return image
+
+
+class AsyncRenderer:
+    """
+    Render annotated images in background threads, off the inference loop.
+
+    `submit` is meant to be used as the on_entry callback of the prediction loops: the
+    images selected by the policy are read, drawn from their VGG polygons (see
+    draw_vgg_entry) and JPEG-encoded to output_dir by a thread pool. At most max_pending
+    renders are queued; beyond that submit waits, which bounds the memory held by the pool.
+
+    Images whose entry has a "width" or "height" above max_size are rendered on an
+    overview downscaled to max_size, read with tiled_inference.open_tiled_image, so that
+    an orthophoto is never decoded at full resolution. Without rasterio they are read whole.
+
+    Args:
+        output_dir (str): Directory of the rendered images (same file names as the inputs).
+        policy (RenderPolicy): Which images to render.
+        class_mapping (dict): Class index -> label, for the colors.
+        workers (int): Number of render threads.
+        max_pending (int): Maximum number of queued renders.
+        max_size (int): Longest side of the rendered large images, in pixels (None: full size).
+    """
+
+    def __init__(self, output_dir, policy, class_mapping=None, workers=2, max_pending=16, max_size=None):
+        self.output_dir = output_dir
+        self.policy = policy
+        self.class_mapping = class_mapping
+        self.max_size = max_size
+        self.submitted = 0
+        self.rendered = 0
+        self.failed = 0
+        self.render_s = 0.0
+        self._index = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers) if policy.mode != "off" else None
+        if self._executor is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def submit(self, img_path, filename, entry):
+        """Queue the rendering of an image if the policy selects it."""
+        index = self._index
+        self._index += 1
+        if self._executor is None or not self.policy.selected(index):
+            return
+        self._slots.acquire()
+        self.submitted += 1
+        self._executor.submit(self._render, img_path, filename, entry)
+
+    def _render(self, img_path, filename, entry):
+        start = time.perf_counter()
+        try:
+            image, scale = self._read(img_path, entry)
+            if image is None:
+                raise ValueError(f"unable to read {img_path}")
+            draw_vgg_entry(image, entry, self.class_mapping, scale=scale)
+            if not cv2.imwrite(os.path.join(self.output_dir, filename), image):
+                raise ValueError(f"unable to write {filename}")
+            rendered = True
+        except Exception as e:
+            print(f"Error rendering {img_path}: {e}")
+            rendered = False
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.rendered += rendered
+            self.failed += not rendered
+            self.render_s += time.perf_counter() - start
+
+    def _read(self, img_path, entry):
+        """Image to draw on and the scale of the polygons, downscaled for large images."""
+        if self.max_size and max(entry.get("width", 0), entry.get("height", 0)) > self.max_size:
+            try:
+                image = open_tiled_image(img_path)
+            except ImportError:
+                return cv2.imread(img_path), 1.0
+            try:
+                return image.read_overview(self.max_size)
+            finally:
+                image.close()
+        return cv2.imread(img_path), 1.0
+
+    def close(self):
+        """Wait for the queued renders."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """Render statistics for the run report (render_s is summed over the threads)."""
+        return {"mode": self.policy.mode, "submitted": self.submitted, "rendered": self.rendered,
+                "failed": self.failed, "render_s": self.render_s}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
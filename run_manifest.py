@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from vgg_jsonl import open_vgg_writer
+
+# Threads used to hash the new or modified images (the hashing is I/O bound)
+HASH_THREADS = 8
+
+
+def file_sha256(path, chunk_size=2 ** 20):
+    """SHA-256 of a file's content, read by chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """
+    Append-only record of the images already predicted, for resumable and incremental runs.
+
+    Every predicted image is appended to a JSON-Lines file with the SHA-256 of its content,
+    the key of the model (hash of the weights file and of the prediction settings) and its
+    VGG entry. Re-running over the same folder only predicts the images whose content or
+    model key is not in the manifest; the others are taken from it. Records are written as
+    soon as an image is predicted, so an interrupted run resumes where it stopped.
+
+    Only the file offset of the records of the current model is kept in memory: the VGG
+    entries are read back from the file one at a time when they are iterated. Records of
+    other models, and records superseded by a newer one, are stale; compact drops them.
+
+    The content hash of an image is reused without reading the file when its path, size
+    and modification time match a previous record.
+
+    Args:
+        path (str): Manifest file (.jsonl), created if missing.
+        weights_path (str): Model weights; their hash is part of the model key.
+        config (dict): Prediction settings that change the outputs (confidence, thresholds,
+            tile size, ...), also part of the model key. Must be JSON serializable.
+    """
+
+    def __init__(self, path, weights_path, config=None):
+        self.path = path
+        settings = json.dumps(config or {}, sort_keys=True, default=str)
+        self.model_key = hashlib.sha256(
+            (file_sha256(weights_path) + settings).encode()).hexdigest()
+        self.offsets = {}
+        self.file_stats = {}
+        self.hashes = {}
+        self.stale = 0
+        self.cached = 0
+        self.predicted = 0
+        self._load()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "ab")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        truncate_at = None
+        with open(self.path, "rb") as f:
+            for line_number, line in enumerate(f, 1):
+                line_offset, offset = offset, offset + len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable manifest line {line_number} in {self.path}")
+                    if not line.endswith(b"\n"):
+                        truncate_at = line_offset
+                    continue
+                self.file_stats[record["image"]] = (record["size"], record["mtime_ns"], record["sha256"])
+                self._index(record["sha256"], record["model"], line_offset)
+        if truncate_at is not None:
+            # Last line cut by an interrupted run: the image is predicted again, and the
+            # line is removed so that the next record starts on a line of its own
+            os.truncate(self.path, truncate_at)
+
+    def _index(self, sha256, model, offset):
+        if model != self.model_key:
+            self.stale += 1
+            return
+        if sha256 in self.offsets:
+            self.stale += 1
+        self.offsets[sha256] = offset
+
+    def _content_hash(self, img_path):
+        img_path = os.path.abspath(img_path)
+        stat = os.stat(img_path)
+        known = self.file_stats.get(img_path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return img_path, known[2], stat
+        return img_path, file_sha256(img_path), stat
+
+    def content_hash(self, img_path):
+        """
+        SHA-256 of an image, as computed by pending (or from a previous record when the
+        file is unchanged), so that other caches can be keyed without hashing it again.
+        """
+        abs_path = os.path.abspath(img_path)
+        if abs_path not in self.hashes:
+            _, sha256, stat = self._content_hash(abs_path)
+            self.hashes[abs_path] = (sha256, stat.st_size, stat.st_mtime_ns)
+        return self.hashes[abs_path][0]
+
+    def pending(self, image_files, threads=HASH_THREADS):
+        """
+        Hash the images and return the ones that have no entry for the current model.
+
+        Returns:
+            list: Paths to predict, in input order.
+        """
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            hashed = list(executor.map(self._content_hash, image_files))
+
+        pending = []
+        for img_path, (abs_path, sha256, stat) in zip(image_files, hashed):
+            self.hashes[abs_path] = (sha256, stat.st_size, stat.st_mtime_ns)
+            if sha256 in self.offsets:
+                self.cached += 1
+            else:
+                pending.append(img_path)
+        return pending
+
+    def record(self, img_path, filename, entry):
+        """Append the VGG entry of a newly predicted image (img_path must have gone through pending)."""
+        img_path = os.path.abspath(img_path)
+        sha256, size, mtime_ns = self.hashes[img_path]
+        offset = self._file.tell()
+        self._file.write(json.dumps({
+            "image": img_path, "size": size, "mtime_ns": mtime_ns, "sha256": sha256,
+            "model": self.model_key, "filename": filename, "entry": entry,
+        }).encode("utf-8") + b"\n")
+        self._file.flush()
+        self._index(sha256, self.model_key, offset)
+        self.predicted += 1
+
+    def iter_entries(self, image_files):
+        """
+        Yield the (filename, VGG entry) pairs of image_files, cached and new, in input order.
+
+        The entries are read from the manifest file one at a time. Images without an entry
+        (failed predictions) are left out.
+        """
+        with open(self.path, "rb") as f:
+            for img_path in image_files:
+                sha256, size, _ = self.hashes[os.path.abspath(img_path)]
+                if sha256 in self.offsets:
+                    f.seek(self.offsets[sha256])
+                    entry = json.loads(f.readline())["entry"]
+                    filename = os.path.basename(img_path)
+                    yield filename, dict(entry, filename=filename, size=size)
+
+    def export(self, image_files, output_file):
+        """Write the VGG annotations of image_files (see iter_entries) to output_file in input order."""
+        with open_vgg_writer(output_file, indent=4) as writer:
+            for filename, entry in self.iter_entries(image_files):
+                writer.write(filename, entry)
+
+    def compact(self):
+        """
+        Rewrite the manifest with only the latest record of each image content for the
+        current model, dropping the stale records.
+
+        The new file is written next to the manifest and replaces it once complete.
+        """
+        if not self.stale:
+            return
+        self._file.close()
+        temp_path = self.path + ".tmp"
+        offsets = {}
+        with open(self.path, "rb") as source, open(temp_path, "wb") as target:
+            for sha256, offset in sorted(self.offsets.items(), key=lambda item: item[1]):
+                source.seek(offset)
+                offsets[sha256] = target.tell()
+                target.write(source.readline())
+        os.replace(temp_path, self.path)
+        self.offsets, self.stale = offsets, 0
+        self._file = open(self.path, "ab")
+
+    def stats(self):
+        """Cached and newly predicted image counts, and stale records, for the run report."""
+        return {"cached": self.cached, "predicted": self.predicted, "stale": self.stale}
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,172 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def count_annotations(data):
+    """Count images, regions (polygons and RLE masks) and polygon vertices of VGG annotations."""
+    regions = [region for image_data in data.values() for region in image_data.get('regions', {}).values()]
+    rle_regions = sum(len(image_data.get('rle_regions', {})) for image_data in data.values())
+    return {
+        "images": len(data),
+        "regions": len(regions) + rle_regions,
+        "vertices": sum(len(region['shape_attributes'].get('all_points_x', [])) for region in regions),
+    }
+
+
+def _max_rss_mb():
+    """High-water mark of the process resident memory over its lifetime, in MB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def _rss_mb():
+    """Current resident memory of the process in MB, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _cuda():
+    """Return the torch.cuda module when torch is already loaded and a GPU is available."""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda
+    return None
+
+
+class RunStats:
+    """
+    Per-stage and per-image instrumentation for the prediction scripts.
+
+    Each `stage()` block records wall time, CPU time and memory, plus any counts
+    (images, regions, vertices, ...) attached to it. Stage totals and per-image
+    records are written as a machine-readable JSON report at the end of the run.
+
+    The memory of a stage is its resident memory at the end and the change over the
+    stage ("rss_mb", "rss_delta_mb", read from /proc where available), and how much it
+    raised the process high-water mark ("max_rss_growth_mb"). Allocation peaks (CUDA,
+    tracemalloc) are only measured by the outermost open stage: a nested stage would
+    reset the peak of the stage around it.
+
+    Args:
+        trace_memory (bool): Also record the Python allocation peak of each outermost
+            stage with tracemalloc (slower). On GPU the CUDA allocation peak is always
+            recorded.
+        profile_stage (str): Name of a stage to run under cProfile.
+        profile_path (str): Where to write the cProfile statistics of profile_stage.
+    """
+
+    def __init__(self, trace_memory=False, profile_stage=None, profile_path=None):
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profile_path = profile_path
+        self.stages = {}
+        self.images = []
+        self.info = {}
+        self._open_stages = 0
+        self._profiler = cProfile.Profile() if profile_stage else None
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, image=None, **counts):
+        """
+        Measure a block of code. The yielded dictionary holds the counts of the
+        stage and can be updated inside the block, e.g. `record["regions"] = n`.
+        """
+        record = dict(counts)
+        outermost = self._open_stages == 0
+        cuda = _cuda() if outermost else None
+        if cuda is not None:
+            cuda.reset_peak_memory_stats()
+        if self.trace_memory and outermost:
+            tracemalloc.reset_peak()
+        rss_start, max_rss_start = _rss_mb(), _max_rss_mb()
+        self._open_stages += 1
+        profiling = self._profiler is not None and name == self.profile_stage
+        if profiling:
+            self._profiler.enable()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            self._open_stages -= 1
+            if profiling:
+                self._profiler.disable()
+            memory = {"max_rss_growth_mb": _max_rss_mb() - max_rss_start}
+            rss = _rss_mb()
+            if rss is not None:
+                memory.update(rss_mb=rss, rss_delta_mb=rss - rss_start)
+            if self.trace_memory and outermost:
+                memory["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            if cuda is not None:
+                memory["cuda_peak_mb"] = cuda.max_memory_allocated() / 2 ** 20
+            self._add(name, image, wall, cpu, memory, record)
+
+    def _add(self, name, image, wall, cpu, memory, counts):
+        totals = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "memory": {}, "counts": {}})
+        totals["calls"] += 1
+        totals["wall_s"] += wall
+        totals["cpu_s"] += cpu
+        for key, value in memory.items():
+            totals["memory"][key] = max(totals["memory"].get(key, 0.0), value)
+        for key, value in counts.items():
+            totals["counts"][key] = totals["counts"].get(key, 0) + value
+        if image is not None:
+            self.images.append({"image": image, "stage": name, "wall_s": wall, "cpu_s": cpu,
+                                "memory": memory, "counts": counts})
+
+    def add_image(self, image, name, wall, cpu, **counts):
+        """
+        Append a per-image record measured outside a stage block, e.g. the share of one
+        image in a batched stage (the stage totals are recorded by the batch itself).
+        """
+        self.images.append({"image": image, "stage": name, "wall_s": wall, "cpu_s": cpu,
+                            "memory": {}, "counts": counts})
+
+    def set(self, key, value):
+        """Attach extra run information (configuration, queue statistics, ...) to the report."""
+        self.info[key] = value
+
+    def report(self):
+        """Return the run report as a dictionary."""
+        return {
+            "wall_s": time.perf_counter() - self._start,
+            "cpu_s": time.process_time() - self._cpu_start,
+            "max_rss_mb": _max_rss_mb(),
+            "stages": self.stages,
+            "images": self.images,
+            "info": self.info,
+        }
+
+    def write_report(self, path):
+        """Write the JSON report, and the cProfile statistics if a stage was profiled."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        if self._profiler is not None and self.profile_path:
+            self._profiler.dump_stats(self.profile_path)
+        print(f"Run statistics saved to {path}")
+
+    def summary(self):
+        """Print one line per stage: calls, wall time, CPU time and counts."""
+        for name, totals in self.stages.items():
+            counts = ", ".join(f"{key}={value}" for key, value in totals["counts"].items())
+            print(f"{name:<24} calls={totals['calls']:<6} wall={totals['wall_s']:.2f}s "
+                  f"cpu={totals['cpu_s']:.2f}s {counts}")
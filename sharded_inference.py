@@ -0,0 +1,155 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import torch
+from inference import predict_to_annotations
+from run_stats import RunStats
+from vgg_jsonl import iter_vgg_annotations, open_vgg_writer
+
+# Model of the current worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def _init_worker(weights, threads):
+    global _worker_model
+    from ultralytics import YOLO
+
+    torch.set_num_threads(threads)
+    _worker_model = YOLO(weights, task="segment")
+
+
+def _predict_shard(task):
+    """
+    Predict one slice of the images into its own JSON-Lines file (runs in a worker).
+
+    Returns the paths written, the shard wall time and the per-image records of the shard.
+    """
+    image_files, shard_file, class_mapping, batch_size, options, predict_kwargs = task
+    written = []
+    stats = RunStats()
+    start = time.perf_counter()
+    predict_to_annotations(_worker_model, image_files, class_mapping, shard_file, batch_size, stats=stats,
+                           on_entry=lambda img_path, filename, entry: written.append(img_path),
+                           **options, **predict_kwargs)
+    return written, time.perf_counter() - start, stats.images
+
+
+def shard_images(image_files, shards, batch_size):
+    """
+    Split the image list into at most `shards` consecutive slices.
+
+    The slice size is a multiple of batch_size, so the shards are cut on the batch
+    boundaries of a serial run and every image is predicted in the same batch.
+    """
+    shard_size = math.ceil(len(image_files) / max(1, shards) / batch_size) * batch_size
+    return [image_files[start:start + shard_size] for start in range(0, len(image_files), max(1, shard_size))]
+
+
+def predict_sharded(weights, image_files, class_mapping, output_file, batch_size, workers,
+                    threads_per_worker=None, shards=None, stats=None, result_filter=None, merge=None,
+                    on_entry=None, mp_context=None, rle_classes=None, **predict_kwargs):
+    """
+    Multi-process counterpart of inference.predict_to_annotations for CPU nodes.
+
+    The image list is split into consecutive shards (see shard_images) that are
+    predicted by `workers` processes. Each worker loads the model once, limits torch to
+    threads_per_worker intra-op threads and writes its shards to temporary JSON-Lines
+    files. Each shard is appended to output_file, and its entries passed to on_entry, as
+    soon as it and the shards before it are done, so an interrupted run keeps what was
+    merged. The output is identical to a serial predict_to_annotations run with the same
+    batch size. A shard whose worker fails is reported and its images are skipped.
+
+    Args:
+        weights (str): Model file (.pt or exported, see inference_backend), loaded by every worker.
+        image_files (list): Paths of the images to process.
+        class_mapping (dict): Mapping of class indices to class labels.
+        output_file (str): VGG file to write (.json, or .jsonl for JSON-Lines), or None
+            (see inference.predict_to_annotations).
+        batch_size (int): Number of images per model call in each worker.
+        workers (int): Number of worker processes.
+        threads_per_worker (int): Torch threads per worker (None = cores / workers).
+        shards (int): Number of shards (None = 4 per worker, for load balancing).
+        stats (RunStats): Optional instrumentation; the run is recorded as a "predict_sharded"
+            stage and the sharding settings and shard times as "sharding". The per-image
+            records of the workers (see predict_to_annotations) are added to stats.images.
+        result_filter, merge, rle_classes: See predict_to_annotations (result_filter must be picklable,
+            e.g. a functools.partial of filter_yolo_results).
+        on_entry (callable): Called as on_entry(image path, filename, entry) as each shard is merged.
+        mp_context: multiprocessing context or start method name (None = "fork" where
+            available). With "spawn" or "forkserver" the calling script must be guarded by
+            `if __name__ == "__main__"`.
+        **predict_kwargs: Extra arguments for model.predict (conf, device, ...). The device
+            must be "cpu": the workers are CPU processes and a forked child cannot use a
+            CUDA context of its parent.
+
+    Raises:
+        ValueError: If a GPU device is requested.
+        RuntimeError: If CUDA is already initialized in this process and the workers
+            would be forked (use mp_context="spawn" from a guarded script).
+    """
+    device = predict_kwargs.get("device", "cpu")
+    if str(device).lower() != "cpu":
+        raise ValueError(f"Sharded inference runs on CPU workers, got device={device!r}: "
+                         "use predict_to_annotations for GPU inference")
+    if mp_context is None and "fork" in multiprocessing.get_all_start_methods():
+        mp_context = "fork"
+    if isinstance(mp_context, str):
+        mp_context = multiprocessing.get_context(mp_context)
+    if (mp_context or multiprocessing.get_context()).get_start_method() == "fork" and torch.cuda.is_initialized():
+        raise RuntimeError("CUDA is initialized in this process and cannot be used after fork: "
+                           "run the sharded inference with mp_context='spawn' from a script guarded "
+                           "by `if __name__ == \"__main__\"`, or before any CUDA call")
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    shard_lists = shard_images(image_files, shards or 4 * workers, batch_size)
+    options = {"result_filter": result_filter, "merge": merge, "rle_classes": rle_classes}
+
+    shard_dir = tempfile.mkdtemp(prefix="predict_shards_")
+    shard_walls, failed = [], []
+    try:
+        tasks = [(shard, os.path.join(shard_dir, f"shard-{index:05d}.jsonl"), class_mapping,
+                  batch_size, options, predict_kwargs)
+                 for index, shard in enumerate(shard_lists)]
+        with stats.stage("predict_sharded", images=len(image_files)) if stats is not None else nullcontext({}) as record:
+            record["written"] = 0
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                     initializer=_init_worker, initargs=(weights, threads_per_worker)) as executor, \
+                    open_vgg_writer(output_file, indent=4) if output_file else nullcontext() as writer:
+                futures = [executor.submit(_predict_shard, task) for task in tasks]
+                # Shards are merged in input order as soon as they and the ones before them
+                # are done, so that on_entry (e.g. RunManifest.record) follows the run
+                for index, ((_, shard_file, *_), future) in enumerate(zip(tasks, futures)):
+                    try:
+                        written, shard_wall, images = future.result()
+                    except Exception as e:
+                        print(f"Error during sharded prediction of shard {index}: {e}. Skipping its images.")
+                        failed.append(index)
+                        continue
+                    shard_walls.append(shard_wall)
+                    if stats is not None:
+                        stats.images.extend(images)
+                    if written:
+                        for img_path, (filename, entry) in zip(written, iter_vgg_annotations(shard_file)):
+                            if writer is not None:
+                                writer.write(filename, entry)
+                            if on_entry is not None:
+                                on_entry(img_path, filename, entry)
+                        record["written"] += len(written)
+                        os.remove(shard_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    if stats is not None:
+        stats.set("sharding", {
+            "workers": workers,
+            "threads_per_worker": threads_per_worker,
+            "shards": len(shard_lists),
+            "failed_shards": failed,
+            "shard_wall_s": shard_walls,
+        })
+    if output_file:
+        print(f"VGG annotations with confidence scores saved to {output_file}")
@@ -0,0 +1,121 @@
+import argparse
+import math
+import numpy as np
+from post_processing_yolo import save_vgg_annotations
+
+# Répartition des classes par défaut, proche de celle des tuiles urbaines
+DEFAULT_CLASS_MIX = {
+    'green_space': 0.25,
+    'parking': 0.15,
+    'sidewalk': 0.15,
+    'roof_tuiles': 0.15,
+    'roof_ardoise': 0.05,
+    'roof_beton': 0.05,
+    'roof_autres': 0.05,
+    'pathway': 0.05,
+    'solar_panel': 0.04,
+    'pool': 0.03,
+    'line': 0.03,
+}
+
+
+def _blob(rng, cx, cy, radius, vertices, jitter=0.3):
+    """Contour fermé irrégulier (type masque YOLO) autour de (cx, cy)."""
+    angles = np.sort(rng.uniform(0, 2 * math.pi, vertices))
+    radii = radius * (1 - jitter * rng.random(vertices))
+    x = cx + radii * np.cos(angles)
+    y = cy + radii * np.sin(angles)
+    return x.astype(np.float32).tolist(), y.astype(np.float32).tolist()
+
+
+def generate_vgg_predictions(images=100, regions_per_image=100, vertices=60, overlap=0.3,
+                             class_mix=None, tile_size=1024, min_radius=10, max_radius=120, seed=0):
+    """
+    Génère un fichier de prédictions VGG synthétique et reproductible.
+
+    Args:
+        images (int): Nombre d'images.
+        regions_per_image (int): Nombre de régions par image.
+        vertices (int): Nombre de sommets par polygone.
+        overlap (float): Proportion de régions placées sur une région existante de même
+            classe (densité de chevauchement, de 0 à 1).
+        class_mix (dict): Poids de chaque label (DEFAULT_CLASS_MIX par défaut).
+        tile_size (int): Taille des tuiles, en pixels.
+        min_radius, max_radius (float): Rayon des polygones, en pixels.
+        seed (int): Graine du générateur.
+
+    Returns:
+        dict: Annotations VGG au format de yolo_results_to_vgg (coordonnées float32, confiances).
+    """
+    class_mix = class_mix or DEFAULT_CLASS_MIX
+    labels = list(class_mix)
+    weights = np.array([class_mix[label] for label in labels], dtype=float)
+    weights /= weights.sum()
+    rng = np.random.default_rng(seed)
+
+    data = {}
+    for image_index in range(images):
+        filename = f"tile_{image_index:06d}.jpg"
+        regions = {}
+        centers = {}
+        for region_index in range(regions_per_image):
+            label = labels[rng.choice(len(labels), p=weights)]
+            radius = rng.uniform(min_radius, max_radius)
+            previous = centers.get(label)
+            if previous and rng.random() < overlap:
+                # Placer la région à cheval sur une région existante de même classe
+                px, py, pr = previous[rng.integers(len(previous))]
+                angle = rng.uniform(0, 2 * math.pi)
+                distance = rng.uniform(0, pr + radius) * 0.8
+                cx, cy = px + distance * math.cos(angle), py + distance * math.sin(angle)
+            else:
+                cx, cy = rng.uniform(0, tile_size), rng.uniform(0, tile_size)
+            centers.setdefault(label, []).append((cx, cy, radius))
+            all_points_x, all_points_y = _blob(rng, cx, cy, radius, vertices)
+            regions[str(region_index)] = {
+                "shape_attributes": {
+                    "name": "polygon",
+                    "all_points_x": all_points_x,
+                    "all_points_y": all_points_y
+                },
+                "region_attributes": {
+                    "label": label,
+                    "confidence": float(np.float32(rng.uniform(0.25, 1.0)))
+                }
+            }
+        data[filename] = {
+            "fileref": "",
+            "size": 0,
+            "filename": filename,
+            "base64_img_data": "",
+            "file_attributes": {},
+            "regions": regions
+        }
+    return data
+
+
+def parse_class_mix(text):
+    """Lit une répartition de classes de la forme "green_space=0.5,parking=0.5"."""
+    class_mix = {}
+    for item in text.split(','):
+        label, weight = item.split('=')
+        class_mix[label.strip()] = float(weight)
+    return class_mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génère des prédictions VGG synthétiques.")
+    parser.add_argument("output", help="Fichier de sortie (.json ou .jsonl)")
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--regions", type=int, default=100, help="Régions par image")
+    parser.add_argument("--vertices", type=int, default=60, help="Sommets par polygone")
+    parser.add_argument("--overlap", type=float, default=0.3, help="Densité de chevauchement (0-1)")
+    parser.add_argument("--class-mix", type=parse_class_mix, default=None,
+                        help='Répartition des classes, ex. "green_space=0.5,parking=0.5"')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = generate_vgg_predictions(args.images, args.regions, args.vertices, args.overlap,
+                                    args.class_mix, seed=args.seed)
+    save_vgg_annotations(data, args.output)
+    print(f"{args.images} images synthétiques enregistrées dans : {args.output}")
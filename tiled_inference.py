@@ -0,0 +1,294 @@
+import os
+from contextlib import nullcontext
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import Polygon, MultiPolygon
+from shapely.ops import unary_union
+from vgg_columnar import shoelace_areas
+from vgg_jsonl import open_vgg_writer
+from vgg_regions import polygon_region
+
+try:
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.windows import Window
+except ImportError:  # rasterio is only needed for tiled inference (windowed reads)
+    rasterio = None
+
+# Tile size (the model's training imgsz) and overlap between neighbouring tiles, in pixels
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+# Minimum intersection over the smaller mask for two same-class detections from
+# different tiles to be considered the same object
+MATCH_THRESHOLD = 0.5
+
+
+def tile_windows(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Windows (x, y, width, height) covering an image with overlapping tiles.
+
+    Tiles are spaced by tile_size - overlap; the last row and column are aligned on the
+    image border so that every tile has the full size (unless the image is smaller).
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"The overlap must be in [0, tile_size), got {overlap} for tiles of {tile_size}")
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, tile_size - overlap))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(tile_size, width), min(tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+class _RasterioImage:
+    """Windowed reads of a raster: only the requested tile is decoded."""
+
+    def __init__(self, path):
+        self.dataset = rasterio.open(path)
+        self.width, self.height = self.dataset.width, self.dataset.height
+
+    def _bgr(self, data):
+        if data.shape[0] < 3:
+            data = np.repeat(data[:1], 3, axis=0)
+        # Bands are RGB, the model expects BGR arrays like cv2.imread
+        return np.ascontiguousarray(data[::-1].transpose(1, 2, 0))
+
+    def _bands(self):
+        return list(range(1, min(self.dataset.count, 3) + 1))
+
+    def read(self, x, y, width, height):
+        return self._bgr(self.dataset.read(indexes=self._bands(), window=Window(x, y, width, height)))
+
+    def read_overview(self, max_size):
+        """
+        Read the whole image downscaled so that its longest side is at most max_size.
+
+        The raster is resampled while it is read (using its overviews when the file has
+        some), so the full-resolution image is never held in memory.
+
+        Returns:
+            tuple: (BGR image, scale from image to overview coordinates).
+        """
+        scale = min(1.0, max_size / max(self.width, self.height))
+        out_shape = (len(self._bands()), max(1, round(self.height * scale)), max(1, round(self.width * scale)))
+        data = self.dataset.read(indexes=self._bands(), out_shape=out_shape, resampling=Resampling.average)
+        return self._bgr(data), scale
+
+    def close(self):
+        self.dataset.close()
+
+
+def open_tiled_image(path):
+    """
+    Open an image for tile reads.
+
+    Tiles are read as windows of the file with rasterio (GeoTIFF orthophotos, but also
+    the JPEG, PNG, ... formats of GDAL), so memory does not depend on the image size.
+    rasterio is therefore required in tiled mode: decoding a whole orthophoto is what
+    tiling avoids. 8-bit RGB (or single-band) images are expected.
+    """
+    if rasterio is None:
+        raise ImportError("Tiled inference reads image windows with rasterio: pip install rasterio")
+    return _RasterioImage(path)
+
+
+def _tile_detections(result, x, y):
+    """(class index, confidence, (N, 2) polygon in image coordinates) of one tile result."""
+    if result.masks is None or result.boxes is None:
+        return []
+    offset = np.array([x, y], dtype=np.float32)
+    return [(cls, conf, segment + offset)
+            for segment, cls, conf in zip(result.masks.xy, result.boxes.cls.int().tolist(), result.boxes.conf.tolist())
+            if len(segment) >= 3]
+
+
+def reconcile_tile_detections(detections, tile_ids, threshold=MATCH_THRESHOLD):
+    """
+    Merge the detections of the same object found by neighbouring tiles.
+
+    Two detections are matched when they have the same class, come from different tiles
+    and their intersection covers at least `threshold` of the smaller one (a mask cut
+    by a tile border is mostly contained in the complete mask of the next tile). Matched
+    detections are unioned and keep the highest confidence; the others are returned
+    unchanged.
+
+    Args:
+        detections (list): (class index, confidence, (N, 2) polygon) tuples.
+        tile_ids (list): Tile of each detection.
+        threshold (float): Minimum intersection over the smaller area.
+
+    Returns:
+        list: (class index, confidence, (N, 2) polygon) tuples, in the order of the first
+        detection of each group.
+    """
+    polygons = []
+    for _, _, points in detections:
+        polygon = Polygon(points)
+        if not polygon.is_valid:
+            polygon = polygon.buffer(0)
+        polygons.append(polygon)
+
+    parent = list(range(len(detections)))
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    if len(polygons) > 1:
+        geometries = np.array(polygons, dtype=object)
+        left, right = STRtree(geometries).query(geometries, predicate='intersects')
+        classes = np.array([cls for cls, _, _ in detections])
+        tiles = np.asarray(tile_ids)
+        candidates = (left < right) & (classes[left] == classes[right]) & (tiles[left] != tiles[right])
+        left, right = left[candidates], right[candidates]
+        areas = shapely.area(geometries)
+        smaller = np.minimum(areas[left], areas[right])
+        overlap = shapely.area(shapely.intersection(geometries[left], geometries[right]))
+        matched = overlap >= threshold * np.where(smaller > 0, smaller, np.inf)
+        for idx1, idx2 in zip(left[matched].tolist(), right[matched].tolist()):
+            root1, root2 = find(idx1), find(idx2)
+            if root1 != root2:
+                parent[max(root1, root2)] = min(root1, root2)
+
+    groups = {}
+    for idx in range(len(detections)):
+        groups.setdefault(find(idx), []).append(idx)
+
+    reconciled = []
+    for group in groups.values():
+        cls = detections[group[0]][0]
+        confidence = max(detections[idx][1] for idx in group)
+        if len(group) == 1:
+            reconciled.append((cls, confidence, detections[group[0]][2]))
+            continue
+        merged = unary_union([polygons[idx] for idx in group])
+        for polygon in (merged.geoms if isinstance(merged, MultiPolygon) else [merged]):
+            if not polygon.is_empty:
+                reconciled.append((cls, confidence, np.asarray(polygon.exterior.coords)))
+    return reconciled
+
+
+def _filter_area(detections, min_area):
+    """Drop the detections whose polygon area is below min_area (same area as Polygon.area)."""
+    if min_area <= 0 or not detections:
+        return detections
+    offsets = np.zeros(len(detections) + 1, dtype=np.int64)
+    np.cumsum([len(points) for _, _, points in detections], out=offsets[1:])
+    points = np.concatenate([points for _, _, points in detections])
+    areas = shoelace_areas(points[:, 0], points[:, 1], offsets)
+    return [detection for detection, area in zip(detections, areas) if area >= min_area]
+
+
+def predict_tiled(model, img_path, batch_size, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                  result_filter=None, match_threshold=MATCH_THRESHOLD, min_area=0, **predict_kwargs):
+    """
+    Run the model on overlapping tiles of one large image.
+
+    Tiles are read batch by batch (see open_tiled_image), so the decoded pixels held in
+    memory are bounded by batch_size tiles whatever the image size. The masks of every
+    tile are shifted into image coordinates and the duplicates found in the overlap
+    bands are merged (see reconcile_tile_detections).
+
+    Args:
+        model: An ultralytics YOLO model.
+        img_path (str): Path of the image.
+        batch_size (int): Number of tiles per model call.
+        tile_size (int): Tile size, in pixels.
+        overlap (int): Overlap between neighbouring tiles, in pixels.
+        result_filter (callable): Optional function applied to each tile result, e.g.
+            filter_yolo_results with class_thresholds. It must not filter on area: an
+            object cut by a tile border is small in each tile, use min_area instead.
+        match_threshold (float): See reconcile_tile_detections.
+        min_area (float): Minimum polygon area, in image pixels, applied to the
+            reconciled detections.
+        **predict_kwargs: Extra arguments for model.predict (conf, device, ...).
+
+    Returns:
+        tuple: (width, height, tile count, detections) with detections as
+        (class index, confidence, (N, 2) polygon) tuples.
+    """
+    image = open_tiled_image(img_path)
+    try:
+        windows = tile_windows(image.width, image.height, tile_size, overlap)
+        detections, tile_ids = [], []
+        for start in range(0, len(windows), batch_size):
+            batch = windows[start:start + batch_size]
+            tiles = [image.read(*window) for window in batch]
+            results = model.predict(source=tiles, batch=len(tiles), stream=True, **predict_kwargs)
+            for tile_id, (x, y, _, _), result in zip(range(start, start + len(batch)), batch, results):
+                if result_filter is not None:
+                    result = result_filter(result)
+                tile_detections = _tile_detections(result, x, y)
+                detections.extend(tile_detections)
+                tile_ids.extend([tile_id] * len(tile_detections))
+            del tiles
+        detections = reconcile_tile_detections(detections, tile_ids, match_threshold)
+        return image.width, image.height, len(windows), _filter_area(detections, min_area)
+    finally:
+        image.close()
+
+
+def predict_tiled_to_annotations(model, image_files, class_mapping, output_file, batch_size, stats=None,
+                                 tile_size=TILE_SIZE, overlap=TILE_OVERLAP, result_filter=None,
+                                 match_threshold=MATCH_THRESHOLD, min_area=0, on_entry=None, **predict_kwargs):
+    """
+    Tiled counterpart of inference.predict_to_annotations for images larger than the model input.
+
+    Every image is predicted tile by tile (see predict_tiled) and written as one VGG
+    entry, in image coordinates, with its "width" and "height" so that the COCO
+    conversion gets the real image size. `save` is ignored: annotated images are drawn
+    from the entries by rendering.AsyncRenderer.
+
+    Args:
+        model: An ultralytics YOLO model.
+        image_files (list): Paths of the images to process.
+        class_mapping (dict): Mapping of class indices to class labels.
+        output_file (str): VGG file to write (.json, or .jsonl for JSON-Lines), or None
+            (see inference.predict_to_annotations).
+        batch_size (int): Number of tiles per model call.
+        stats (RunStats): Optional instrumentation; each image is recorded as a "predict_tiled" stage.
+        tile_size, overlap, result_filter, match_threshold, min_area: See predict_tiled.
+        on_entry (callable): See inference.predict_to_annotations.
+        **predict_kwargs: Extra arguments for model.predict (conf, device, ...).
+    """
+    predict_kwargs.pop("save", None)
+    with open_vgg_writer(output_file, indent=4) if output_file else nullcontext() as writer:
+        for img_path in image_files:
+            image_filename = os.path.basename(img_path)
+            with stats.stage("predict_tiled", image=image_filename) if stats is not None else nullcontext({}) as record:
+                try:
+                    width, height, tiles, detections = predict_tiled(
+                        model, img_path, batch_size, tile_size, overlap, result_filter, match_threshold,
+                        min_area, **predict_kwargs)
+                except Exception as e:
+                    print(f"Error during tiled prediction for {img_path}: {e}")
+                    continue
+                record.update(tiles=tiles, regions=len(detections))
+
+            regions = {}
+            for region_index, (cls, confidence, points) in enumerate(detections):
+                label = class_mapping.get(cls, f"class_{cls}")
+                regions[str(region_index)] = polygon_region(points, label, confidence)
+            vgg_entry = {
+                "fileref": "",
+                "size": os.path.getsize(img_path),
+                "filename": image_filename,
+                "base64_img_data": "",
+                "file_attributes": {},
+                "regions": regions,
+                "width": width,
+                "height": height
+            }
+            if writer is not None:
+                writer.write(image_filename, vgg_entry)
+            if on_entry is not None:
+                on_entry(img_path, image_filename, vgg_entry)
+    if output_file:
+        print(f"VGG annotations with confidence scores saved to {output_file}")
@@ -0,0 +1,226 @@
+import numpy as np
+
+
+# Nombre de polygones traités à la fois par shoelace_areas
+AREA_CHUNK_SIZE = 4096
+
+
+def shoelace_areas(x, y, offsets):
+    """
+    Surface de plusieurs polygones stockés bout à bout (formule du lacet).
+
+    x, y : coordonnées de tous les polygones concaténées ; offsets : début de chaque
+    polygone dans x / y, suivi de la longueur totale. Les polygones n'ont pas besoin
+    d'être fermés ; ceux de moins de 3 points ont une surface nulle. Le calcul reprend
+    celui de GEOS (anneau fermé, coordonnées translatées sur le premier point, somme
+    dans l'ordre des sommets), si bien que le résultat est identique à `Polygon.area`.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, counts = offsets[:-1], np.diff(offsets)
+    areas = np.zeros(len(counts))
+    polygons = np.flatnonzero(counts >= 3)
+    if not polygons.size:
+        return areas
+
+    first, last = starts[polygons], starts[polygons] + counts[polygons] - 1
+    closed = (x[first] == x[last]) & (y[first] == y[last])
+    ring_lengths = counts[polygons] + ~closed
+    # Polygones triés par longueur puis traités par paquets, chaque paquet étant
+    # complété jusqu'à son plus long anneau par le premier point (termes nuls)
+    order = np.argsort(ring_lengths, kind='stable')
+    for chunk in np.array_split(order, max(1, -(-len(order) // AREA_CHUNK_SIZE))):
+        length = int(ring_lengths[chunk].max())
+        columns = np.arange(length)
+        chunk_starts, chunk_counts = first[chunk, None], counts[polygons[chunk], None]
+        index = np.where(columns < chunk_counts, chunk_starts + columns, chunk_starts)
+        ring_x = x[index] - x[chunk_starts]
+        ring_y = y[index]
+        terms = ring_x[:, 1:-1] * (ring_y[:, :-2] - ring_y[:, 2:])
+        terms[columns[1:-1] >= ring_lengths[chunk, None] - 1] = 0.0
+        # Somme cumulée : additions dans l'ordre des sommets, comme GEOS
+        areas[polygons[chunk]] = np.abs(np.cumsum(terms, axis=1)[:, -1]) / 2
+    return areas
+
+
+def polygon_bounds(x, y, offsets):
+    """Boîtes englobantes (min_x, min_y, max_x, max_y) de polygones stockés bout à bout (NaN si vide)."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, counts = offsets[:-1], np.diff(offsets)
+    bounds = np.full((len(counts), 4), np.nan)
+    non_empty = counts > 0
+    if non_empty.any():
+        starts = starts[non_empty]
+        bounds[non_empty] = np.stack([
+            np.minimum.reduceat(x, starts), np.minimum.reduceat(y, starts),
+            np.maximum.reduceat(x, starts), np.maximum.reduceat(y, starts),
+        ], axis=1)
+    return bounds
+
+
+class ColumnarAnnotations:
+    """
+    Représentation compacte, en tableaux, d'annotations VGG.
+
+    Les coordonnées de toutes les régions sont stockées dans deux tampons plats
+    `x` et `y` (float32 par défaut) et repérées par `coord_offsets` ; les régions
+    de chaque image sont repérées par `region_offsets`. Chaque région a un indice
+    de classe (`class_ids`, -1 sans label, libellés dans `labels`) et une confiance
+    (`confidences`, NaN si absente).
+
+    Ce qui ne rentre pas dans les colonnes est conservé à part pour que
+    l'aller-retour avec le dictionnaire VGG soit sans perte : les attributs de
+    fichier, les autres attributs de région, les formes non polygonales et les
+    polygones dont les coordonnées ne tiennent pas exactement dans `dtype`. Les
+    coordonnées issues de YOLO (float32) tiennent toutes dans les colonnes ; après
+    un post-traitement shapely (float64), dtype=np.float64 évite ces copies.
+    """
+
+    def __init__(self, image_keys, image_attributes, region_offsets, region_keys,
+                 coord_offsets, x, y, class_ids, confidences, labels,
+                 extra_region_attributes=None, extra_shapes=None):
+        self.image_keys = image_keys
+        self.image_attributes = image_attributes
+        self.region_offsets = region_offsets
+        self.region_keys = region_keys
+        self.coord_offsets = coord_offsets
+        self.x = x
+        self.y = y
+        self.class_ids = class_ids
+        self.confidences = confidences
+        self.labels = labels
+        self.extra_region_attributes = extra_region_attributes or {}
+        self.extra_shapes = extra_shapes or {}
+
+    @property
+    def image_count(self):
+        return len(self.image_keys)
+
+    @property
+    def region_count(self):
+        return len(self.class_ids)
+
+    @property
+    def nbytes(self):
+        """Taille des tableaux numériques, en octets."""
+        return sum(array.nbytes for array in (self.region_offsets, self.coord_offsets, self.x, self.y,
+                                              self.class_ids, self.confidences))
+
+    @classmethod
+    def from_vgg(cls, data, dtype=np.float32):
+        """Construit la représentation en colonnes à partir d'un dictionnaire VGG."""
+        image_keys, image_attributes = [], []
+        region_offsets, region_keys = [0], []
+        coord_offsets, xs, ys = [0], [], []
+        class_ids, confidences = [], []
+        label_ids = {}
+        extra_region_attributes, extra_shapes = {}, {}
+        sequential_keys = True
+
+        for image_key, image_data in data.items():
+            image_keys.append(image_key)
+            image_attributes.append({key: value for key, value in image_data.items() if key != 'regions'})
+            regions = image_data.get('regions', {})
+            for position, (region_id, region_data) in enumerate(regions.items()):
+                region_index = len(class_ids)
+                region_keys.append(region_id)
+                sequential_keys = sequential_keys and region_id == str(position)
+
+                attributes = dict(region_data['region_attributes'])
+                label = attributes.pop('label', None)
+                class_ids.append(-1 if label is None else label_ids.setdefault(label, len(label_ids)))
+                confidence = attributes.get('confidence')
+                if isinstance(confidence, float) and float(np.float32(confidence)) == confidence:
+                    confidences.append(attributes.pop('confidence'))
+                else:
+                    # Confiance absente ou non représentable en float32 : conservée telle quelle
+                    confidences.append(np.nan)
+                if attributes:
+                    extra_region_attributes[region_index] = attributes
+
+                shape_attr = region_data['shape_attributes']
+                if set(shape_attr) == {'name', 'all_points_x', 'all_points_y'} and shape_attr['name'] == 'polygon':
+                    xs.append(shape_attr['all_points_x'])
+                    ys.append(shape_attr['all_points_y'])
+                    coord_offsets.append(coord_offsets[-1] + len(shape_attr['all_points_x']))
+                    # Coordonnées entières (annotations manuelles) : le type est conservé à part
+                    if shape_attr['all_points_x'] and not isinstance(shape_attr['all_points_x'][0], float):
+                        extra_shapes[region_index] = shape_attr
+                else:
+                    extra_shapes[region_index] = shape_attr
+                    coord_offsets.append(coord_offsets[-1])
+            region_offsets.append(len(class_ids))
+
+        total = coord_offsets[-1]
+        exact_x = np.fromiter((value for values in xs for value in values), dtype=np.float64, count=total)
+        exact_y = np.fromiter((value for values in ys for value in values), dtype=np.float64, count=total)
+        x, y = exact_x.astype(dtype), exact_y.astype(dtype)
+        coord_offsets = np.asarray(coord_offsets, dtype=np.int64)
+
+        # Les régions dont les coordonnées ne tiennent pas exactement dans `dtype`
+        # gardent aussi leur forme d'origine, pour un aller-retour sans perte
+        lossy = np.flatnonzero((x != exact_x) | (y != exact_y))
+        polygon_regions = [
+            region_data['shape_attributes']
+            for image_data in data.values() for region_data in image_data.get('regions', {}).values()
+        ] if lossy.size else []
+        for region_index in np.unique(np.searchsorted(coord_offsets, lossy, side='right') - 1).tolist():
+            extra_shapes.setdefault(region_index, polygon_regions[region_index])
+
+        return cls(
+            image_keys, image_attributes,
+            np.asarray(region_offsets, dtype=np.int64),
+            None if sequential_keys else region_keys,
+            coord_offsets, x, y,
+            np.asarray(class_ids, dtype=np.int16),
+            np.asarray(confidences, dtype=np.float32),
+            list(label_ids),
+            extra_region_attributes, extra_shapes,
+        )
+
+    def region(self, region_index):
+        """Reconstruit le dictionnaire VGG d'une région."""
+        shape_attr = self.extra_shapes.get(region_index)
+        if shape_attr is None:
+            start, end = self.coord_offsets[region_index], self.coord_offsets[region_index + 1]
+            shape_attr = {
+                'name': 'polygon',
+                'all_points_x': self.x[start:end].tolist(),
+                'all_points_y': self.y[start:end].tolist()
+            }
+        region_attributes = {}
+        class_id = int(self.class_ids[region_index])
+        if class_id >= 0:
+            region_attributes['label'] = self.labels[class_id]
+        confidence = self.confidences[region_index]
+        if not np.isnan(confidence):
+            region_attributes['confidence'] = float(confidence)
+        region_attributes.update(self.extra_region_attributes.get(region_index, {}))
+        return {'shape_attributes': shape_attr, 'region_attributes': region_attributes}
+
+    def to_vgg(self):
+        """Reconstruit le dictionnaire d'annotations VGG."""
+        data = {}
+        for image_index, image_key in enumerate(self.image_keys):
+            start, end = self.region_offsets[image_index], self.region_offsets[image_index + 1]
+            regions = {}
+            for position, region_index in enumerate(range(start, end)):
+                region_id = str(position) if self.region_keys is None else self.region_keys[region_index]
+                regions[region_id] = self.region(region_index)
+            image_data = dict(self.image_attributes[image_index])
+            image_data['regions'] = regions
+            data[image_key] = image_data
+        return data
+
+    def image_of_regions(self):
+        """Indice de l'image de chaque région."""
+        return np.repeat(np.arange(self.image_count), np.diff(self.region_offsets))
+
+    def areas(self):
+        """Surface de chaque région (nulle pour les formes non polygonales)."""
+        return shoelace_areas(self.x, self.y, self.coord_offsets)
+
+    def vertex_counts(self):
+        """Nombre de sommets de chaque région."""
+        return np.diff(self.coord_offsets)
@@ -0,0 +1,191 @@
+import glob
+import json
+import os
+
+# Format « VGG JSON-Lines » : une image par ligne, sous la forme {"<clé VGG>": {...entrée VGG...}}.
+# Un fichier peut être découpé en plusieurs morceaux : annotations.jsonl devient
+# annotations-00000.jsonl, annotations-00001.jsonl, ... lus dans cet ordre.
+JSONL_EXTENSION = ".jsonl"
+
+
+def is_jsonl_path(path):
+    """Indique si le chemin désigne des annotations au format JSON-Lines (fichier, morceaux ou dossier)."""
+    return str(path).endswith(JSONL_EXTENSION) or os.path.isdir(path)
+
+
+def _shard_path(path, index):
+    base, ext = os.path.splitext(path)
+    return f"{base}-{index:05d}{ext}"
+
+
+def list_shards(path):
+    """Renvoie, dans l'ordre de lecture, les fichiers JSON-Lines qui composent `path`."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f"*{JSONL_EXTENSION}")))
+    if os.path.exists(path):
+        return [path]
+    base, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(base)}-[0-9][0-9][0-9][0-9][0-9]{ext}"))
+
+
+def iter_vgg_annotations(path):
+    """
+    Parcourt les annotations VGG image par image et renvoie des couples (clé, entrée).
+
+    Pour le format JSON-Lines, une seule ligne est en mémoire à la fois. Un
+    fichier JSON classique est chargé en entier puis parcouru.
+    """
+    if not is_jsonl_path(path):
+        with open(path, 'r') as f:
+            yield from json.load(f).items()
+        return
+
+    shards = list_shards(path)
+    if not shards:
+        raise FileNotFoundError(f"Aucun fichier d'annotations JSON-Lines trouvé pour : {path}")
+    for shard in shards:
+        with open(shard, 'r') as f:
+            for line in f:
+                if line.strip():
+                    (key, entry), = json.loads(line).items()
+                    yield key, entry
+
+
+class VggJsonlWriter:
+    """
+    Écrit des annotations VGG au format JSON-Lines, une image à la fois.
+
+    Args:
+        path (str): Fichier de sortie (.jsonl).
+        shard_size (int): Nombre maximal d'images par fichier. Si défini, les images
+            sont écrites dans path-00000.jsonl, path-00001.jsonl, ...
+        append (bool): Ajoute les images à la suite des fichiers existants au lieu
+            de les remplacer.
+    """
+
+    def __init__(self, path, shard_size=None, append=False):
+        self.path = path
+        self.shard_size = shard_size
+        self.append = append
+        self._file = None
+        self._shard_index = 0
+        self._shard_count = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if append and shard_size:
+            shards = list_shards(path)
+            if shards and shards != [path]:
+                self._shard_index = len(shards) - 1
+                with open(shards[-1], 'r') as f:
+                    self._shard_count = sum(1 for line in f if line.strip())
+        elif not append:
+            for shard in list_shards(path):
+                os.remove(shard)
+
+    def _open_next(self):
+        if self._file is not None:
+            self._file.close()
+            self._shard_index += 1
+            self._shard_count = 0
+        path = _shard_path(self.path, self._shard_index) if self.shard_size else self.path
+        self._file = open(path, 'a')
+
+    def write(self, key, entry):
+        """Ajoute une image (clé VGG et entrée) au fichier."""
+        if self._file is None:
+            self._open_next()
+        if self.shard_size and self._shard_count >= self.shard_size:
+            self._open_next()
+        self._file.write(json.dumps({key: entry}, separators=(',', ':')))
+        self._file.write("\n")
+        self._shard_count += 1
+
+    def write_all(self, data):
+        """Ajoute toutes les images d'un dictionnaire d'annotations VGG."""
+        for key, entry in data.items():
+            self.write(key, entry)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class VggJsonWriter:
+    """
+    Écrit un fichier d'annotations VGG JSON classique image par image, sans garder
+    le document en mémoire. Le fichier obtenu est identique, octet pour octet, à
+    json.dump(data, f, indent=indent) sur le dictionnaire complet.
+    """
+
+    def __init__(self, path, indent=None):
+        self.path = path
+        self.indent = indent
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'w')
+        self._count = 0
+
+    def write(self, key, entry):
+        """Ajoute une image (clé VGG et entrée) au fichier."""
+        if self.indent is None:
+            prefix = "{" if self._count == 0 else ", "
+            self._file.write(f"{prefix}{json.dumps(key)}: {json.dumps(entry)}")
+        else:
+            padding = " " * self.indent
+            prefix = "{\n" if self._count == 0 else ",\n"
+            body = json.dumps(entry, indent=self.indent).replace("\n", "\n" + padding)
+            self._file.write(f"{prefix}{padding}{json.dumps(key)}: {body}")
+        self._count += 1
+
+    def write_all(self, data):
+        """Ajoute toutes les images d'un dictionnaire d'annotations VGG."""
+        for key, entry in data.items():
+            self.write(key, entry)
+
+    def close(self):
+        if self._file is not None:
+            if self._count == 0:
+                self._file.write("{}")
+            else:
+                self._file.write("}" if self.indent is None else "\n}")
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_vgg_writer(path, indent=None, shard_size=None, append=False):
+    """Ouvre un écrivain d'annotations VGG : JSON-Lines pour un chemin .jsonl, JSON classique sinon."""
+    if is_jsonl_path(path):
+        return VggJsonlWriter(path, shard_size=shard_size, append=append)
+    if append or shard_size:
+        raise ValueError("L'ajout et le découpage en morceaux ne sont possibles qu'au format JSON-Lines (.jsonl).")
+    return VggJsonWriter(path, indent=indent)
+
+
+def map_vgg_annotations(func, src_path, dst_path, shard_size=None):
+    """
+    Applique une fonction de post-traitement image par image, en flux.
+
+    `func` reçoit un dictionnaire VGG d'une seule image et renvoie un dictionnaire
+    VGG (post_process_masks, merge_overlapping_masks, PostProcessingPipeline.run,
+    functools.partial(filter_by_confidence, class_thresholds=...), ...). Seule
+    l'image en cours est en mémoire ; la sortie est écrite au format JSON-Lines.
+    """
+    with VggJsonlWriter(dst_path, shard_size=shard_size) as writer:
+        for key, entry in iter_vgg_annotations(src_path):
+            writer.write_all(func({key: entry}))
@@ -0,0 +1,50 @@
+from coco_rle import mask_rle
+
+# Construction des régions VGG partagée par la conversion YOLO, la fusion raster et
+# l'inférence tuilée
+
+
+def polygon_region(points, label, confidence):
+    """Région VGG polygonale d'un tableau (N, 2) de coordonnées dans le repère de l'image."""
+    all_points_x, all_points_y = points.T.tolist()
+    return {
+        "shape_attributes": {
+            "name": "polygon",
+            "all_points_x": all_points_x,
+            "all_points_y": all_points_y
+        },
+        "region_attributes": {
+            "label": label,
+            "confidence": confidence
+        }
+    }
+
+
+def rle_region(mask, label, confidence):
+    """
+    Région « rle » d'un masque binaire (hauteur, largeur) dans le repère de l'image,
+    avec la surface et la boîte englobante COCO du masque (voir coco_rle.mask_rle).
+
+    Ces régions ne sont pas des régions VGG : elles sont rangées sous la clé
+    "rle_regions" de l'entrée, à côté de "regions" qui reste polygonale.
+
+    Returns:
+        dict: La région, ou None pour un masque vide.
+    """
+    annotation = mask_rle(mask)
+    if annotation is None:
+        return None
+    bbox, area, rle = annotation
+    return {
+        "shape_attributes": {
+            "name": "rle",
+            "size": rle["size"],
+            "counts": rle["counts"],
+            "bbox": bbox,
+            "area": area
+        },
+        "region_attributes": {
+            "label": label,
+            "confidence": confidence
+        }
+    }